@@ -0,0 +1,9 @@
+"""
+Performance benchmarks for the job server.
+
+    routing: per request overhead of routing, measured in memory
+    load: throughput and latency of the HTTP API under a configurable load
+
+Every benchmark prints its results as JSON, so runs of different versions can
+be compared
+"""
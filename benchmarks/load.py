@@ -0,0 +1,405 @@
+#! /usr/bin/env python3
+"""
+Drives the HTTP API with a configurable load and reports throughput and
+latency as JSON.
+
+By default the server is started in this process, in a temporary directory
+with its own database and logs, and its runtimes are replaced by stand-ins
+that take a fixed time per job. With --url the load is sent to a server that
+is already running, e.g. one started with ./scripts/start_server.sh.
+
+Concurrent clients send --requests requests in total, picking /jobs/add/,
+/jobs/{id}/ or /jobs/list/ at random in the proportions of --mix. Views are of
+jobs added by this run. Completed jobs are followed on /jobs/stream/, which
+gives the time from submitting each job until it finished.
+
+Run from the root directory:
+    python3 -m benchmarks.load --concurrency 20 --requests 5000
+"""
+
+# default modules
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Sequence, Union
+
+# installed modules
+import aiohttp
+from aiohttp.test_utils import TestServer
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# pylint: disable=fixme
+# TODO: this key must be moved to an environment variable
+API_KEY = '$YboMhcaz7U+3;;M(~t|BX-~ 2kw|ZII2e+s$pw5sBqf$?g]-BYlq.! R/qMR/V='
+
+OPERATIONS = ("add", "view", "list")
+FINAL_STATUSES = ("Success", "Runtime Error")
+
+
+class StandInRuntime:
+    """
+    Takes the place of a runtime: every job succeeds after a fixed latency
+    """
+
+    def __init__(self, runtime_id: int, latency: float) -> None:
+        self.runtime_id = runtime_id
+        self.latency = latency
+
+    def get_is_available(self) -> bool:
+        """
+        A stand-in is never busy with work from outside the pool
+        """
+        return True
+
+    async def run_async(self, _job) -> int:
+        """
+        Wait for the latency and report success
+        """
+        await asyncio.sleep(self.latency)
+        return 0
+
+    execute_async = run_async
+    simulate_async = run_async
+    echo_async = run_async
+
+
+def percentile(values: Sequence[float], fraction: float) -> Union[None, float]:
+    """
+    Return the nearest rank percentile of values, None if there are none
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarise(latencies: List[float], errors: int, seconds: float) -> dict:
+    """
+    Return the count, error count, throughput and latency percentiles of a set
+    of requests
+    """
+    def milliseconds(value: Union[None, float]) -> Union[None, float]:
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        "count": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": milliseconds(percentile(latencies, 0.5)),
+        "p99_ms": milliseconds(percentile(latencies, 0.99)),
+    }
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parse a mix such as "add=1,view=4,list=1"
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs a positive weight")
+    return mix
+
+
+def random_job() -> str:
+    """
+    Return a random valid job string, so that jobs are rarely identical
+    """
+    return ", ".join(
+        f"{random.choice('XYZ')}({random.randrange(360)})"
+        for _ in range(random.randint(1, 5))
+    )
+
+
+# the run is a record of everything the clients measured
+# pylint: disable=too-many-instance-attributes,too-few-public-methods
+class LoadRun:
+    """
+    Sends the load and collects the measurements
+    """
+
+    def __init__(self, args: argparse.Namespace, base_url: str) -> None:
+        self.args = args
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"api_key": args.api_key}
+        self.remaining = args.requests
+        self.latencies = {name: [] for name in OPERATIONS}
+        self.errors = dict.fromkeys(OPERATIONS, 0)
+        # job id -> time the add request was sent / time the job finished
+        self.submitted = {}
+        self.finished = {}
+        self.all_finished = asyncio.Event()
+        self.is_sending = True
+
+    async def follow_completions(self, session: aiohttp.ClientSession) -> None:
+        """
+        Record when each job finishes, from the status update stream
+        """
+        async with session.get(
+            f"{self.base_url}/jobs/stream/",
+            params={"status": ",".join(FINAL_STATUSES)},
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=None)
+        ) as resp:
+            async for line in resp.content:
+                if not line.startswith(b"data: "):
+                    continue
+                update = json.loads(line[len(b"data: "):])
+                if "id" not in update:
+                    continue
+                self.finished[update["id"]] = time.perf_counter()
+                self.check_all_finished()
+
+    def check_all_finished(self) -> None:
+        """
+        Wake the run once sending is over and every added job finished
+        """
+        if not self.is_sending and self.finished.keys() >= self.submitted.keys():
+            self.all_finished.set()
+
+    async def send(self, session: aiohttp.ClientSession, operation: str) -> None:
+        """
+        Send one request and record its latency
+        """
+        job_ids = list(self.submitted)
+        if operation == "view" and not job_ids:
+            operation = "add"
+
+        start_time = time.perf_counter()
+        if operation == "add":
+            request = session.post(
+                f"{self.base_url}/jobs/add/",
+                headers=self.headers,
+                json={"job": random_job(), "mode": self.args.mode}
+            )
+        elif operation == "view":
+            request = session.get(
+                f"{self.base_url}/jobs/{random.choice(job_ids)}/",
+                headers=self.headers
+            )
+        else:
+            request = session.get(
+                f"{self.base_url}/jobs/list/",
+                params={"limit": self.args.list_limit},
+                headers=self.headers
+            )
+
+        async with request as resp:
+            data = await resp.read()
+        self.latencies[operation].append(time.perf_counter() - start_time)
+
+        if resp.status >= 400:
+            self.errors[operation] += 1
+        elif operation == "add":
+            self.submitted[json.loads(data)["id"]] = start_time
+
+    async def client(self, session: aiohttp.ClientSession) -> None:
+        """
+        Send requests until the run has sent --requests in total
+        """
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        while self.remaining > 0:
+            self.remaining -= 1
+            await self.send(session, random.choices(names, weights)[0])
+
+    async def run(self) -> dict:
+        """
+        Send the load, wait for the added jobs to finish and return the report
+        """
+        connector = aiohttp.TCPConnector(limit=self.args.concurrency + 1)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            follower = asyncio.create_task(self.follow_completions(session))
+            # give the stream a moment to subscribe before jobs are added
+            await asyncio.sleep(0.1)
+
+            start_time = time.perf_counter()
+            await asyncio.gather(*(
+                self.client(session) for _ in range(self.args.concurrency)
+            ))
+            send_seconds = time.perf_counter() - start_time
+
+            self.is_sending = False
+            self.check_all_finished()
+            try:
+                await asyncio.wait_for(
+                    self.all_finished.wait(),
+                    self.args.drain_timeout
+                )
+            except asyncio.TimeoutError:
+                pass
+            follower.cancel()
+
+        return self.report(start_time, send_seconds)
+
+    def report(self, start_time: float, send_seconds: float) -> dict:
+        """
+        Return the measurements of the run
+        """
+        completions = [
+            self.finished[job_id] - submitted
+            for job_id, submitted in self.submitted.items()
+            if job_id in self.finished
+        ]
+        finished_times = [
+            self.finished[job_id] for job_id in self.submitted
+            if job_id in self.finished
+        ]
+        all_latencies = [
+            latency for latencies in self.latencies.values()
+            for latency in latencies
+        ]
+        jobs = summarise(completions, 0, send_seconds)
+        del jobs["errors"], jobs["throughput_rps"]
+
+        return {
+            "config": {
+                key: value for key, value in vars(self.args).items()
+                if key not in ("api_key", "output")
+            },
+            "send_seconds": round(send_seconds, 3),
+            "requests": {
+                "total": summarise(
+                    all_latencies,
+                    sum(self.errors.values()),
+                    send_seconds
+                ),
+                **{
+                    name: summarise(
+                        self.latencies[name],
+                        self.errors[name],
+                        send_seconds
+                    )
+                    for name in OPERATIONS
+                },
+            },
+            "jobs": {
+                "submitted": len(self.submitted),
+                "completed": len(completions),
+                "completion": jobs,
+                "all_completed_seconds": (
+                    round(max(finished_times) - start_time, 3)
+                    if len(completions) == len(self.submitted) and finished_times
+                    else None
+                ),
+            },
+        }
+
+
+async def run_in_process(args: argparse.Namespace) -> dict:
+    """
+    Start the server in this process with stand-in runtimes, run the load
+    against it and shut it down
+    """
+    # the server keeps its database and logs relative to the working
+    # directory, so it runs in a scratch copy of the layout of the repository
+    work_dir = tempfile.mkdtemp(prefix="jobs-benchmark-")
+    os.makedirs(os.path.join(work_dir, "src"))
+    os.makedirs(os.path.join(work_dir, "logs"))
+    previous_dir = os.getcwd()
+    os.chdir(os.path.join(work_dir, "src"))
+    sys.path.insert(0, SRC_DIR)
+
+    # the server modules can only be imported once the paths are set up
+    # pylint: disable=import-outside-toplevel,import-error
+    import jobs as Jobs
+    import main as Main
+    import router as Router
+    from runtime_pool import RuntimePool
+    from storage import STORAGE_INSTANCE
+
+    runtimes = [
+        StandInRuntime(runtime.runtime_id, args.runtime_latency)
+        for runtime in Jobs.RUNTIME_INSTANCES
+    ]
+    Jobs.RUNTIME_INSTANCES[:] = runtimes
+    Jobs.RUNTIME_POOL = RuntimePool(runtimes)
+    STORAGE_INSTANCE.migrate()
+
+    app = Router.create_app()
+    app.on_shutdown.append(Main.on_shutdown)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        return await LoadRun(args, str(server.make_url("/"))).run()
+
+    finally:
+        await server.close()
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args(argv: Union[None, List[str]] = None) -> argparse.Namespace:
+    """
+    Read the command line
+    """
+    parser = argparse.ArgumentParser(
+        description="Load benchmark of the job server API"
+    )
+    parser.add_argument(
+        "--url",
+        help="base url of a running server, e.g. http://localhost:12021."
+        " By default a server is started in this process"
+    )
+    parser.add_argument("--api-key", default=API_KEY)
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="number of concurrent clients (default 10)")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="total number of requests (default 2000)")
+    parser.add_argument("--mix", type=parse_mix, default="add=1,view=4,list=1",
+                        help="relative weights of the operations"
+                        " (default add=1,view=4,list=1)")
+    parser.add_argument("--mode", default="echo",
+                        help="mode of the added jobs (default echo)")
+    parser.add_argument("--list-limit", type=int, default=100,
+                        help="page size of /jobs/list/ requests (default 100)")
+    parser.add_argument("--runtime-latency", type=float, default=0.01,
+                        help="seconds a stand-in runtime takes per job,"
+                        " in process only (default 0.01)")
+    parser.add_argument("--drain-timeout", type=float, default=60,
+                        help="seconds to wait for added jobs to finish"
+                        " (default 60)")
+    parser.add_argument("--seed", type=int,
+                        help="seed of the random choices, for repeatable runs")
+    parser.add_argument("--output",
+                        help="file to write the JSON report to, default stdout")
+    return parser.parse_args(argv)
+
+
+def main(argv: Union[None, List[str]] = None) -> dict:
+    """
+    Run the benchmark and write the report
+    """
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.url:
+        report = asyncio.run(LoadRun(args, args.url).run())
+    else:
+        report = asyncio.run(run_in_process(args))
+
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            output_file.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+"""
+Measures the per request overhead of routing.
+
+Requests are built in memory and handed straight to the application, so the
+time covers resolving the route, the middleware and the handler but no socket
+I/O. Only requests that are answered without storage or runtimes are used, so
+the handlers do a fixed, small amount of work and the routing dominates.
+
+Two applications are measured with the same middleware and handlers:
+    - route_table: the server application, routed by aiohttp's route table
+    - catch_all: every request goes to one catch-all route and is dispatched
+      by matching the path against regular expressions, the way the server
+      routed requests before it used the route table
+The time aiohttp spends resolving the route of each request of the route
+table application is reported on its own as well.
+
+Run from the src directory, the logger writes to ../logs:
+    cd src && python3 ../benchmarks/routing.py
+"""
+
+# default modules
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+
+# installed modules
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# custom modules, importable once src is on the path
+# pylint: disable=wrong-import-position
+import jobs as Jobs
+import logger as Logger
+import router as Router
+
+# method, path, whether the api_key header is sent, expected status
+REQUESTS = [
+    ("OPTIONS", "/jobs/add/", False, 200),
+    ("GET", "/what/is/this/", False, 404),
+    ("GET", "/jobs/list/", False, 401),
+    ("GET", "/jobs/", True, 400),
+    ("POST", "/jobs/list/", True, 400),
+    ("POST", "/jobs/invalid", True, 404),
+]
+
+# the paths the catch-all application dispatches on
+JOB_START_REGEX = re.compile(r"^\/jobs(\/|\?|$)")
+ROOT_REGEX = re.compile(r"^\/jobs(\/|\?)$")
+VIEW_REGEX = re.compile(r"^\/jobs/(\d+)(\/$|\?|$)")
+CATCH_ALL_ROUTES = [
+    (re.compile(r"^\/jobs/add(\/$|\?|$)"), "POST", Jobs.add_job),
+    (re.compile(r"^\/jobs/list(\/$|\?|$)"), "GET", Jobs.list_jobs),
+]
+
+
+async def dispatch_jobs(request: web.Request) -> web.StreamResponse:
+    """
+    Find the handler of a request under /jobs/ by its path
+    """
+    path = request.path
+    if ROOT_REGEX.match(path):
+        return await Jobs.select_function(request)
+
+    for regex, method, handler in CATCH_ALL_ROUTES:
+        if regex.match(path):
+            if request.method != method:
+                return await Jobs.only_allowed(method)(request)
+            return await handler(request)
+
+    view_match = VIEW_REGEX.match(path)
+    if view_match:
+        if request.method != "GET":
+            return await Jobs.only_allowed("GET")(request)
+        request.match_info["job_id"] = view_match.group(1)
+        return await Jobs.view_job(request)
+
+    return await Jobs.function_not_defined(request)
+
+
+async def route_by_path(request: web.Request) -> web.StreamResponse:
+    """
+    Handler of the catch-all route: check the api key of requests under
+    /jobs/ and dispatch them, everything else is not found
+    """
+    if not JOB_START_REGEX.match(request.path):
+        return await Router.not_found(request)
+    return await Jobs.check_api_key(request, dispatch_jobs)
+
+
+def create_catch_all_app() -> web.Application:
+    """
+    Build an application with the middleware of the server and a single
+    catch-all route
+    """
+    app = web.Application(
+        middlewares=[Router.time_request, Router.entry_point]
+    )
+    app.router.add_route("*", "/{tail:.*}", route_by_path)
+    app.on_response_prepare.append(Router.add_server_timing)
+    return app
+
+
+async def measure_resolve(app: web.Application, iterations: int) -> float:
+    """
+    Resolve the route of every request in REQUESTS iterations times
+
+    Return: microseconds per request
+    """
+    total = 0.0
+    for method, path, _, _ in REQUESTS:
+        requests = [
+            make_mocked_request(method, path, app=app)
+            for _ in range(iterations)
+        ]
+        start = time.perf_counter()
+        for request in requests:
+            await app.router.resolve(request)
+        total += time.perf_counter() - start
+
+    return total / (iterations * len(REQUESTS)) * 1e6
+
+
+async def measure_app(app: web.Application, iterations: int) -> dict:
+    """
+    Send every request in REQUESTS iterations times
+
+    Return: microseconds per request, overall and per request
+    """
+    app.freeze()
+
+    results = {}
+    total = 0.0
+    for method, path, is_authorised, status in REQUESTS:
+        headers = {"api_key": Jobs.API_KEY} if is_authorised else {}
+        requests = [
+            make_mocked_request(method, path, headers=headers, app=app)
+            for _ in range(iterations)
+        ]
+
+        start = time.perf_counter()
+        for request in requests:
+            # this is what the server runs for every request
+            # pylint: disable=protected-access
+            response = await app._handle(request)
+        elapsed = time.perf_counter() - start
+
+        if response.status != status:
+            raise RuntimeError(
+                f"{method} {path} returned {response.status}, expected {status}"
+            )
+        results[f"{method} {path}"] = elapsed / iterations * 1e6
+        total += elapsed
+
+    return {
+        "us_per_request": total / (iterations * len(REQUESTS)) * 1e6,
+        "us_per_route": results,
+    }
+
+
+async def measure(iterations: int) -> dict:
+    """
+    Measure both applications and the route resolution
+
+    Return: microseconds per request of each application
+    """
+    app = Router.create_app()
+    route_table = await measure_app(app, iterations)
+    catch_all = await measure_app(create_catch_all_app(), iterations)
+    return {
+        "iterations": iterations,
+        "route_table": route_table,
+        "catch_all": catch_all,
+        "route_table_resolve_us_per_request": await measure_resolve(
+            app,
+            iterations
+        ),
+    }
+
+
+def main() -> None:
+    """
+    Run the benchmark and print the results as JSON
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(measure(args.iterations)), indent=4))
+    Logger.shutdown()
+
+
+if __name__ == "__main__":
+    main()
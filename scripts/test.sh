@@ -8,5 +8,5 @@ rm logs/exception.log 2> /dev/null || true
 echo "This test takes about a minute to complete. Please be patient"
 
 cd src
-rm jobs.db 2> /dev/null || true
+rm jobs.db jobs.db-wal jobs.db-shm 2> /dev/null || true
 python3 -m unittest
\ No newline at end of file
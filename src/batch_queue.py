@@ -0,0 +1,39 @@
+#! /usr/bin/env python3
+"""
+Helpers for background threads that drain a queue in batches
+"""
+
+# default modules
+import queue
+import time
+from typing import Tuple
+
+
+def get_batch(
+    source: queue.Queue,
+    batch_size: int,
+    interval: float
+) -> Tuple[list, bool]:
+    """
+    Block until an item is queued, then keep collecting items until the batch
+    holds batch_size items or interval seconds have passed since the first one.
+    A None item is a stop marker and ends the batch
+
+    Return: the batch, and True if the stop marker was read
+    """
+    batch = [source.get()]
+    deadline = time.monotonic() + interval
+    while len(batch) < batch_size and batch[-1] is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(source.get(timeout=remaining))
+        except queue.Empty:
+            break
+
+    if batch[-1] is None:
+        batch.pop()
+        return batch, True
+
+    return batch, False
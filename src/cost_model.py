@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+"""
+Estimates how long a job will hold a runtime.
+
+The time a runtime needs grows with the number of rotations in the job, so the
+estimate is the rotation count times the time per rotation. The time per
+rotation is learned per mode from the runs that complete, as an exponentially
+weighted moving average, so the estimates follow the runtimes as they change
+"""
+
+# default modules
+import threading
+
+# custom modules
+from job_parser import CompiledJob
+
+
+class CostModel:
+    """
+    Learns the seconds per rotation of every mode. Safe to use from any thread
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 1.0,
+        smoothing: float = 0.2
+    ) -> None:
+        """
+        initial_rate: seconds per rotation assumed until a run was measured
+        smoothing: weight of the newest measurement in the moving average
+        """
+        self.initial_rate = initial_rate
+        self.smoothing = smoothing
+        self.rates = {}
+        self.lock = threading.Lock()
+
+    def estimate(self, job: CompiledJob, mode: str) -> float:
+        """
+        Return the expected runtime of a job in seconds
+        """
+        with self.lock:
+            rate = self.rates.get(mode, self.initial_rate)
+        return rate * len(job)
+
+    def observe(self, job: CompiledJob, mode: str, seconds: float) -> None:
+        """
+        Learn from the measured runtime of a job
+        """
+        rate = seconds / len(job)
+        with self.lock:
+            previous = self.rates.get(mode)
+            if previous is None:
+                self.rates[mode] = rate
+            else:
+                self.rates[mode] = previous + self.smoothing * (rate - previous)
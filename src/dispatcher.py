@@ -0,0 +1,187 @@
+#! /usr/bin/env python3
+"""
+Dispatches accepted jobs to a fixed number of worker coroutines.
+
+The dispatcher runs its own asyncio event loop on a single background thread.
+Jobs are pushed onto one in-memory queue on that loop and drained by the
+workers, so admission is O(1), every in-flight job is a coroutine rather than
+a thread, and the number of threads stays constant no matter how large the
+backlog gets.
+
+The loop is kept separate from the aiohttp loop so that jobs keep running
+independently of any single request or application
+"""
+
+# pylint: disable=broad-except
+
+# default modules
+import asyncio
+import threading
+from typing import Awaitable, Callable, Iterable, Union
+
+# custom modules
+import logger as Logger
+
+
+# the hooks and the loop state are all needed by the dispatcher thread
+# pylint: disable=too-many-instance-attributes
+class Dispatcher:
+    """
+    This class owns the job queue, the event loop and the worker coroutines
+    """
+
+    def __init__(
+        self,
+        worker_count: int,
+        handler: Callable[..., Awaitable[None]],
+        admit: Union[None, Callable[..., Union[None, tuple]]] = None,
+        drain: Union[None, Callable[[], Awaitable[None]]] = None,
+        queue_factory: Callable[[], asyncio.Queue] = asyncio.Queue
+    ) -> None:
+        """
+        worker_count: number of jobs that can be in flight at the same time
+        handler: coroutine function each worker awaits with the arguments of
+            a queued job
+        admit: optional function called on the dispatcher loop with the
+            arguments of every submitted job. It returns the arguments to queue
+            for the handler, or None if the job needs no work of its own
+        drain: optional coroutine function awaited on the dispatcher loop after
+            the workers have stopped, to finish work that admit handed
+            elsewhere
+        queue_factory: creates the job queue on the dispatcher loop. The
+            default queue is first in, first out
+        """
+        self.worker_count = worker_count
+        self.handler = handler
+        self.admit = admit
+        self.drain = drain
+        self.queue_factory = queue_factory
+        self.loop = None
+        self.thread = None
+        self.job_queue = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start the dispatcher thread if it is not running yet
+        """
+        with self.lock:
+            if self.thread:
+                return
+
+            is_ready = threading.Event()
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(
+                target=self.run_loop,
+                name="job-dispatcher",
+                args=(is_ready,),
+                daemon=True
+            )
+            self.thread.start()
+            is_ready.wait()
+
+    def submit(self, *args) -> None:
+        """
+        Queue a job for the workers. This returns immediately and can be called
+        from any thread
+        """
+        if not self.thread:
+            self.start()
+        self.loop.call_soon_threadsafe(self.enqueue_many, [args])
+
+    def submit_many(self, jobs: Iterable[tuple]) -> None:
+        """
+        Queue a batch of jobs, each given as a tuple of handler arguments, in a
+        single hand-over to the dispatcher thread
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return
+        if not self.thread:
+            self.start()
+        self.loop.call_soon_threadsafe(self.enqueue_many, jobs)
+
+    def enqueue_many(self, jobs: list) -> None:
+        """
+        Put a batch of jobs on the queue. Runs on the dispatcher loop
+        """
+        for args in jobs:
+            if self.admit:
+                try:
+                    args = self.admit(*args)
+
+                except Exception as exc:
+                    Logger.log_exception(
+                        f"Exception caught admitting job {args}",
+                        exc
+                    )
+                    continue
+
+                if args is None:
+                    continue
+            self.job_queue.put_nowait(args)
+
+    def queue_depth(self) -> int:
+        """
+        Number of jobs waiting for a worker
+        """
+        if not self.job_queue:
+            return 0
+        return self.job_queue.qsize()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop the workers once every job queued before this call is handled
+        """
+        with self.lock:
+            thread = self.thread
+            loop = self.loop
+            self.thread = None
+
+        if not thread:
+            return
+
+        for _ in range(self.worker_count):
+            loop.call_soon_threadsafe(self.job_queue.put_nowait, None)
+
+        if wait:
+            thread.join()
+
+    def run_loop(self, is_ready: threading.Event) -> None:
+        """
+        Body of the dispatcher thread. Runs the event loop until every worker
+        has read a stop marker and the drain coroutine has returned
+        """
+        asyncio.set_event_loop(self.loop)
+        self.job_queue = self.queue_factory()
+        workers = [
+            self.loop.create_task(self.worker_loop())
+            for _ in range(self.worker_count)
+        ]
+        is_ready.set()
+
+        try:
+            self.loop.run_until_complete(asyncio.gather(*workers))
+            if self.drain:
+                self.loop.run_until_complete(self.drain())
+        finally:
+            self.loop.close()
+
+    async def worker_loop(self) -> None:
+        """
+        Body of each worker coroutine. Runs queued jobs until a stop marker is
+        read
+        """
+        while True:
+            args = await self.job_queue.get()
+            if args is None:
+                return
+
+            try:
+                await self.handler(*args)
+
+            except Exception as exc:
+                Logger.log_exception(
+                    f"Exception caught in dispatcher worker for job {args}",
+                    exc
+                )
@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+"""
+An asyncio queue that shares its consumers fairly between priority classes.
+
+Every class has a weight. Classes are served by weighted fair queueing: serving
+an item moves the virtual finish time of its class 1 / weight ahead, and the
+class with the earliest next finish time is served next. While several classes
+have items queued, each one gets a share of the consumers in proportion to its
+weight, so a large backlog in one class only slows the others down by a bounded
+factor. A class that was idle does not build up credit for later.
+
+Within a class, items are served first in, first out, or, given a cost
+function, shortest expected item first. Waiting items age: every second of
+waiting takes aging off an item's cost, so long items are not held back by a
+steady stream of short ones.
+
+On top of that, an item that has waited longer than max_wait is served ahead
+of the weights, oldest first, so nothing waits without bound even with extreme
+weights. The override takes at most one in every aged_interval serves: once a
+large backlog has aged, the other serves still follow the weights, so items of
+other classes queued after it are not held up behind the whole backlog.
+
+None items are stop markers. They are only served once every other item has
+been served
+"""
+
+# default modules
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, Hashable, Union
+
+# positions in the queue entries. Entries are lists ordered by sort key, with
+# the sequence number as tie breaker
+ENTRY_SEQUENCE = 1
+ENTRY_CLASS = 2
+ENTRY_TIME = 3
+ENTRY_ITEM = 4
+ENTRY_SERVED = 5
+
+
+# the per class state is kept in separate attributes for a cheap _get
+# pylint: disable=too-many-instance-attributes
+class FairQueue(asyncio.Queue):
+    """
+    Weighted fair queue across priority classes, used in place of an
+    asyncio.Queue. Only the storage of the items differs, so put, get and the
+    other queue methods behave as usual
+    """
+
+    def __init__(
+        self,
+        weights: Dict[Hashable, float],
+        classify: Callable[[object], Hashable],
+        max_wait: float = 30,
+        cost: Union[None, Callable[[object], float]] = None,
+        aging: float = 0.0,
+        *,
+        aged_interval: int = 4
+    ) -> None:
+        """
+        weights: the weight of every priority class
+        classify: returns the priority class of a queued item
+        max_wait: seconds after which an item is served ahead of the weights
+        cost: optional function returning the expected cost of an item. Items
+            of a class are then served shortest expected first
+        aging: cost an item loses for every second it waits
+        aged_interval: the max_wait override serves at most one item in every
+            aged_interval serves, 1 lets it serve every item
+        """
+        self.weights = weights
+        self.classify = classify
+        self.max_wait = max_wait
+        self.cost = cost
+        self.aging = aging
+        self.aged_interval = aged_interval
+        super().__init__()
+
+    # asyncio.Queue is extended through these methods, so they are overridden
+    # pylint: disable=attribute-defined-outside-init
+    def _init(self, maxsize: int) -> None:
+        self.classes = {name: [] for name in self.weights}
+        self.counts = dict.fromkeys(self.weights, 0)
+        self.finish_times = dict.fromkeys(self.weights, 0.0)
+        self.virtual_time = 0.0
+        # every waiting entry by sequence number, so oldest first
+        self.waiting = collections.OrderedDict()
+        self.sequence = itertools.count()
+        self.stop_markers = collections.deque()
+        # serves left before the max_wait override may be used again
+        self.aged_cooldown = 0
+
+    def _qsize(self) -> int:
+        return len(self.waiting) + len(self.stop_markers)
+
+    def qsize(self) -> int:
+        """
+        Return the number of queued items. asyncio.Queue reads its own storage
+        here instead of calling _qsize
+        """
+        return self._qsize()
+
+    def empty(self) -> bool:
+        """
+        Return True if the queue is empty, see qsize
+        """
+        return not self._qsize()
+
+    def _put(self, item: object) -> None:
+        if item is None:
+            self.stop_markers.append(item)
+            return
+
+        name = self.classify(item)
+        now = time.monotonic()
+        sequence = next(self.sequence)
+
+        # waiting lowers the cost at the same rate for every item, so adding
+        # the aging at the time of queueing gives a key that never changes
+        if self.cost is None:
+            key = sequence
+        else:
+            key = self.cost(item) + self.aging * now
+
+        entry = [key, sequence, name, now, item, False]
+        heapq.heappush(self.classes[name], entry)
+        self.waiting[sequence] = entry
+
+        if not self.counts[name]:
+            # an idle class starts from the current virtual time
+            self.finish_times[name] = max(
+                self.finish_times[name],
+                self.virtual_time
+            )
+        self.counts[name] += 1
+
+    def _get(self) -> object:
+        if not self.waiting:
+            return self.stop_markers.popleft()
+
+        # starvation protection: the item that waited the longest goes first
+        # once it has waited max_wait, in at most one of aged_interval serves
+        entry = next(iter(self.waiting.values()))
+        if (
+            not self.aged_cooldown
+            and entry[ENTRY_TIME] <= time.monotonic() - self.max_wait
+        ):
+            # it is left in the heap of its class and skipped there later
+            entry[ENTRY_SERVED] = True
+            self.aged_cooldown = self.aged_interval - 1
+        else:
+            self.aged_cooldown = max(self.aged_cooldown - 1, 0)
+            name = min(
+                (name for name, count in self.counts.items() if count),
+                key=lambda name: self.finish_times[name] + 1 / self.weights[name]
+            )
+            entry = heapq.heappop(self.classes[name])
+            while entry[ENTRY_SERVED]:
+                entry = heapq.heappop(self.classes[name])
+
+        name = entry[ENTRY_CLASS]
+        del self.waiting[entry[ENTRY_SEQUENCE]]
+        self.counts[name] -= 1
+        self.finish_times[name] += 1 / self.weights[name]
+        self.virtual_time = max(self.virtual_time, self.finish_times[name])
+        return entry[ENTRY_ITEM]
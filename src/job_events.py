@@ -0,0 +1,178 @@
+#! /usr/bin/env python3
+"""
+Hands job status updates to the requests that are interested in them.
+
+Storage reports every committed job update, from whichever thread committed
+it, to the update listeners below:
+    - JobEvents completes the future of every request waiting for the job to
+      reach a final status, so a finished job is noticed straight away without
+      polling the database
+    - JobStream copies the update into the queue of every stream subscriber
+      whose filters match. The queues are bounded and an update that does not
+      fit is dropped and counted, so a slow client never holds up the thread
+      that committed the update
+All work for a request is handed to the loop of that request
+"""
+
+# default modules
+import asyncio
+import threading
+from typing import Collection, Union
+
+# statuses a job never leaves
+FINAL_STATUSES = ("Success", "Runtime Error")
+
+# every status a job update can set
+UPDATE_STATUSES = ("Started", "Retrying") + FINAL_STATUSES
+
+
+class JobEvents:
+    """
+    Lets coroutines on any event loop wait for jobs to reach a final status
+    """
+
+    def __init__(self) -> None:
+        # job id -> list of (loop, future) of the requests waiting for it
+        self.waiters = {}
+        self.lock = threading.Lock()
+
+    def job_updated(self, update: dict) -> None:
+        """
+        Storage update listener. Completes the futures of every request
+        waiting for the job if it reached a final status
+        """
+        if update["status"] not in FINAL_STATUSES:
+            return
+
+        with self.lock:
+            waiters = self.waiters.pop(update["id"], [])
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(self.complete, future, update)
+
+    @staticmethod
+    def complete(future: asyncio.Future, update: dict) -> None:
+        """
+        Complete a waiting future. Runs on the loop of the future
+        """
+        if not future.done():
+            future.set_result(update)
+
+    def add_waiter(self, job_id: int) -> asyncio.Future:
+        """
+        Return a future of the running loop that completes with the update
+        that takes the job to a final status
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            self.waiters.setdefault(job_id, []).append((loop, future))
+        return future
+
+    def remove_waiter(self, job_id: int, future: asyncio.Future) -> None:
+        """
+        Stop waiting, e.g. after a timeout
+        """
+        with self.lock:
+            waiters = self.waiters.get(job_id)
+            if not waiters:
+                return
+
+            waiters[:] = [entry for entry in waiters if entry[1] is not future]
+            if not waiters:
+                del self.waiters[job_id]
+
+
+class Subscriber:
+    """
+    Bounded queue of the updates for one stream client. Only used on the loop
+    that created it
+    """
+
+    def __init__(
+        self,
+        job_ids: Union[None, Collection[int]] = None,
+        modes: Union[None, Collection[str]] = None,
+        statuses: Union[None, Collection[str]] = None,
+        max_size: int = 1000
+    ) -> None:
+        """
+        job_ids, modes, statuses: only pass updates with a value in these, None
+            passes everything
+        max_size: number of updates held for the client before new ones are
+            dropped
+        """
+        self.job_ids = job_ids
+        self.modes = modes
+        self.statuses = statuses
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(max_size)
+        self.dropped = 0
+
+    def matches(self, update: dict) -> bool:
+        """
+        Return True if the update passes the filters
+        """
+        return (
+            (self.job_ids is None or update["id"] in self.job_ids)
+            and (self.modes is None or update["mode"] in self.modes)
+            and (self.statuses is None or update["status"] in self.statuses)
+        )
+
+    def put(self, update: dict) -> None:
+        """
+        Queue an update, or drop it if the queue is full
+        """
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """
+        Return the number of updates dropped since the last call
+        """
+        dropped = self.dropped
+        self.dropped = 0
+        return dropped
+
+
+class JobStream:
+    """
+    Copies job updates to every subscriber whose filters match
+    """
+
+    def __init__(self) -> None:
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def job_updated(self, update: dict) -> None:
+        """
+        Storage update listener
+        """
+        with self.lock:
+            subscribers = [
+                subscriber for subscriber in self.subscribers
+                if subscriber.matches(update)
+            ]
+
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, update)
+            except RuntimeError:
+                # the loop of the subscriber was closed
+                self.unsubscribe(subscriber)
+
+    def subscribe(self, subscriber: Subscriber) -> None:
+        """
+        Start passing updates to a subscriber
+        """
+        with self.lock:
+            self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """
+        Stop passing updates to a subscriber
+        """
+        with self.lock:
+            self.subscribers.discard(subscriber)
@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+"""
+Removes redundant rotations from compiled jobs.
+
+Rotations about the same axis commute and add up, and a full turn is the
+identity, so the optimized job below has the same effect as the original:
+    - angles are normalised modulo 360
+    - adjacent rotations about the same axis are merged into one
+    - rotations by 0 degrees are dropped
+Merging can leave two rotations about the same axis next to each other, for
+example "X(90), Y(180), Y(180), X(90)", so they are merged in turn
+"""
+
+# default modules
+from array import array
+
+# custom modules
+from job_parser import CompiledJob
+
+FULL_TURN = 360
+
+
+def optimize_job(job: CompiledJob) -> CompiledJob:
+    """
+    Return the shortest equivalent of a job that the rules above give.
+    A job that cancels out completely becomes a single "X(0)", because a job
+    needs at least one rotation
+    """
+    axes = array("B")
+    angles = array("H")
+
+    for axis, angle in zip(job.axes, job.angles):
+        angle %= FULL_TURN
+        if angle == 0:
+            continue
+
+        if axes and axes[-1] == axis:
+            angle = (angles[-1] + angle) % FULL_TURN
+            if angle == 0:
+                axes.pop()
+                angles.pop()
+            else:
+                angles[-1] = angle
+            continue
+
+        axes.append(axis)
+        angles.append(angle)
+
+    if not axes:
+        axes.append(0)
+        angles.append(0)
+
+    if axes == job.axes and angles == job.angles:
+        return job
+    return CompiledJob(axes, angles)
@@ -0,0 +1,144 @@
+#! /usr/bin/env python3
+"""
+Parses job strings into a compact compiled form.
+
+A job string like "X(90), Y(180)" is a sequence of rotations. It is parsed once,
+in a single pass, into a CompiledJob holding one array of axis codes and one
+array of angles. Everything after admission works with the compiled job and
+its canonical string instead of scanning the text again.
+
+Recently parsed valid job strings are memoised, so repeated submissions of the
+same job are not parsed twice. Invalid and very long strings are never kept, so
+clients can not fill the memo with arbitrary request bodies
+"""
+
+# default modules
+import functools
+from array import array
+from typing import Iterator, Tuple, Union
+
+AXES = "XYZ"
+AXIS_CODES = {
+    "X": 0, "Y": 1, "Z": 2,
+    "x": 0, "y": 1, "z": 2,
+}
+DIGITS = "0123456789"
+
+# number of recently parsed job strings to remember
+PARSE_CACHE_SIZE = 4096
+# longest job string that is remembered, about 128 rotations
+PARSE_CACHE_MAX_LENGTH = 1024
+
+
+class CompiledJob:
+    """
+    A parsed job: the axis code and angle of every rotation, in order.
+    Compiled jobs are immutable and compare and hash by their canonical string
+    """
+
+    __slots__ = ("axes", "angles", "text", "text_hash")
+
+    def __init__(self, axes: array, angles: array) -> None:
+        """
+        axes: array("B") of axis codes, 0 for X, 1 for Y and 2 for Z
+        angles: array("H") of angles in degrees
+        """
+        self.axes = axes
+        self.angles = angles
+        self.text = ", ".join(
+            f"{AXES[axis]}({angle})" for axis, angle in zip(axes, angles)
+        )
+        self.text_hash = hash(self.text)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"CompiledJob({self.text!r})"
+
+    def __len__(self) -> int:
+        return len(self.axes)
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        for axis, angle in zip(self.axes, self.angles):
+            yield AXES[axis], angle
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CompiledJob):
+            return NotImplemented
+        return self.text == other.text
+
+    def __hash__(self) -> int:
+        return self.text_hash
+
+
+def parse_job(text: object) -> Union[None, CompiledJob]:
+    """
+    Parse a job string in the format "{Axis}({Angle}), {Axis}({Angle}), ...".
+    Axes are X, Y or Z in either case and angles have 1 to 3 digits
+
+    Return: the compiled job, None if the input is not a valid job string
+    """
+    if not isinstance(text, str):
+        return None
+    if len(text) > PARSE_CACHE_MAX_LENGTH:
+        return parse_job_text(text)
+
+    try:
+        return parse_job_memo(text)
+    except ValueError:
+        return None
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_job_memo(text: str) -> CompiledJob:
+    """
+    Memoised parse_job_text. Invalid strings raise ValueError, and as
+    exceptions are not memoised, only valid jobs are remembered
+    """
+    job = parse_job_text(text)
+    if job is None:
+        raise ValueError("Job string not in the valid format")
+    return job
+
+
+def parse_job_text(text: str) -> Union[None, CompiledJob]:
+    """
+    Single pass parser behind parse_job
+    """
+    axes = array("B")
+    angles = array("H")
+    length = len(text)
+    index = 0
+
+    while True:
+        # {Axis}(
+        if index + 1 >= length or text[index + 1] != "(":
+            return None
+        axis = AXIS_CODES.get(text[index])
+        if axis is None:
+            return None
+        index += 2
+
+        # {Angle}) with 1 to 3 digits
+        start = index
+        angle = 0
+        while index < length and text[index] in DIGITS:
+            angle = angle * 10 + ord(text[index]) - ord("0")
+            index += 1
+        if not 0 < index - start <= 3:
+            return None
+        if index >= length or text[index] != ")":
+            return None
+        index += 1
+
+        axes.append(axis)
+        angles.append(angle)
+
+        if index == length:
+            return CompiledJob(axes, angles)
+
+        # ", " before the next rotation
+        if text[index:index + 2] != ", ":
+            return None
+        index += 2
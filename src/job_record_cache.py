@@ -0,0 +1,118 @@
+#! /usr/bin/env python3
+"""
+Keeps the most recently written job records in memory.
+
+Clients poll the jobs that are still running, and those are the jobs that were
+written last. Storage writes every job it adds and every update it commits
+through to this cache, so reads of active and recently completed jobs are
+served without a database round trip.
+
+Records are only ever added by writes. A record read from the database on a
+cache miss could be older than an update committed at the same time, so misses
+are not cached
+"""
+
+# default modules
+import collections
+import threading
+from typing import Union
+
+# the columns of the job table, in order
+JOB_FIELDS = (
+    "id",
+    "job",
+    "mode",
+    "status",
+    "runtime",
+    "return_code",
+    "runtime_error",
+    "created_time",
+    "start_time",
+    "end_time",
+    "cached",
+    "optimized_job",
+    "priority",
+    "estimated_cost",
+)
+
+
+# this is only a record of the row
+# pylint: disable=too-few-public-methods
+class JobRecord:
+    """
+    A row of the job table
+    """
+
+    __slots__ = JOB_FIELDS
+
+    def __init__(self, **fields) -> None:
+        for name in JOB_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self) -> dict:
+        """
+        Return the record in the format of Storage.get_job
+        """
+        return {name: getattr(self, name) for name in JOB_FIELDS}
+
+
+class JobRecordCache:
+    """
+    Size bounded LRU cache of job records keyed by id. Safe to use from any
+    thread
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        """
+        max_size: maximum number of cached records, 0 disables the cache
+        """
+        self.max_size = max_size
+        self.records = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, job_id: int) -> Union[None, dict]:
+        """
+        Return the job with this id, None if it is not cached
+        """
+        with self.lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return None
+
+            self.records.move_to_end(job_id)
+            return record.to_dict()
+
+    def put(self, record: JobRecord) -> None:
+        """
+        Store a new record, evicting the least recently used records if the
+        cache is full
+        """
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.records[record.id] = record
+            self.records.move_to_end(record.id)
+            while len(self.records) > self.max_size:
+                self.records.popitem(last=False)
+
+    def update(self, job_id: int, **fields) -> None:
+        """
+        Set fields of a cached record. Records that are not cached are left
+        to the database
+        """
+        with self.lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return
+
+            for name, value in fields.items():
+                setattr(record, name, value)
+            self.records.move_to_end(job_id)
+
+    def clear(self) -> None:
+        """
+        Remove every cached record
+        """
+        with self.lock:
+            self.records.clear()
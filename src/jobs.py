@@ -8,204 +8,975 @@ Handle all requests to the endpoints under /jobs/
 # disable the too-many returns warning because the many returns make sense here
 # pylint: disable=too-many-return-statements
 
+# every /jobs/ endpoint is handled here, next to the routing table
+# pylint: disable=too-many-lines
+
 # default modules
-import re
+import asyncio
+import functools
+import multiprocessing
+import os
 import json
 import time
-import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Tuple, Union
 
 # installed modules
 from aiohttp import web
 
 # custom modules
 import logger as Logger
+from cost_model import CostModel
+from dispatcher import Dispatcher
+from fair_queue import FairQueue
+from job_events import (
+    FINAL_STATUSES,
+    UPDATE_STATUSES,
+    JobEvents,
+    JobStream,
+    Subscriber
+)
+from job_optimizer import optimize_job
+from job_parser import CompiledJob, parse_job
+from metrics import REGISTRY, Counter, Gauge, Histogram
+from request_timing import timed
+from result_cache import ResultCache
 from runtime import Runtime
+from runtime_adapter import as_async_runtime
+from runtime_pool import RuntimePool
+from simulator import SimulationBatcher
 from storage import STORAGE_INSTANCE
 
 # pylint: disable=fixme
 # TODO: this key must be moved to an environment variable
 API_KEY = '$YboMhcaz7U+3;;M(~t|BX-~ 2kw|ZII2e+s$pw5sBqf$?g]-BYlq.! R/qMR/V='
 
-JOB_INPUT_REGEX = re.compile(r"^[XYZ]\(\d{1,3}\)(, [XYZ]\(\d{1,3}\))*$")
+# page sizes for /jobs/list/
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+# maximum number of jobs in one /jobs/add/batch/ request
+BATCH_MAX_SIZE = 1000
+
+# longest wait, in seconds, a client can ask /jobs/{id}/ for
+VIEW_MAX_WAIT = 60
+
+# number of rows read from storage at a time by /jobs/export/
+EXPORT_CHUNK_SIZE = 1000
+
+# updates held for a /jobs/stream/ client before new ones are dropped, and
+# seconds between keepalive comments on an idle stream
+STREAM_QUEUE_SIZE = 1000
+STREAM_KEEPALIVE = 15
+
+JOB_MODES = ("verbatim", "simulation", "echo")
 
 RUNTIME_INSTANCES = []
 for i in range(0, 5):
     RUNTIME_INSTANCES.append(Runtime(i + 1))
 
+# results of jobs in these modes only depend on the job, so they can be
+# served from the result cache. The cache is disabled unless a size is set
+CACHEABLE_MODES = ("simulation", "echo")
+RESULT_CACHE = ResultCache(
+    max_size=int(os.environ.get("JOB_RESULT_CACHE_SIZE", "0")),
+    ttl=float(os.environ.get("JOB_RESULT_CACHE_TTL", "300"))
+)
+
+# queued runs are served by weighted fair queueing across these priority
+# classes. A run that has waited PRIORITY_MAX_WAIT seconds goes first, in at
+# most one of every PRIORITY_AGED_INTERVAL serves
+DEFAULT_PRIORITY = "normal"
+PRIORITY_WEIGHTS = {
+    "high": 8,
+    "normal": 4,
+    "low": 1,
+}
+PRIORITY_MAX_WAIT = 30
+PRIORITY_AGED_INTERVAL = 4
+
+# within a priority class, queued runs are served shortest expected first
+# ("sjf") or in the order they were queued ("fifo"). Under sjf a waiting run
+# loses SJF_AGING seconds of effective cost for every second it waits, so long
+# runs still get their turn
+SCHEDULING_POLICY = os.environ.get("JOB_SCHEDULING_POLICY", "sjf")
+SJF_AGING = 0.1
+
+# learns the runtime per rotation from the runs that complete
+COST_MODEL = CostModel()
+
+# identical jobs in these modes share a single run while one is queued or
+# running. IN_FLIGHT maps (job, mode, priority) to that run and is only used on
+# the dispatcher loop
+COALESCE_MODES = ("verbatim", "simulation", "echo")
+IN_FLIGHT = {}
+
+# return code given to the jobs of a run that raised, decoded as an unknown
+# error
+RUN_ERROR = 4
+
+# simulation jobs are simulated on this many worker processes, separate from
+# the runtimes. 0 simulates them on the dispatcher loop instead
+SIMULATION_PROCESSES = int(
+    os.environ.get("JOB_SIMULATION_PROCESSES", str(os.cpu_count() or 1))
+)
+
+# wakes up the requests that wait for a job to finish
+JOB_EVENTS = JobEvents()
+STORAGE_INSTANCE.add_update_listener(JOB_EVENTS.job_updated)
+
+# pushes status updates to the /jobs/stream/ clients
+JOB_STREAM = JobStream()
+STORAGE_INSTANCE.add_update_listener(JOB_STREAM.job_updated)
+
+# runtimes that only implement the blocking interface are wrapped in an adapter
+RUNTIME_POOL = RuntimePool(
+    as_async_runtime(instance) for instance in RUNTIME_INSTANCES
+)
+
+# job and runtime metrics for /metrics
+METRICS_START_TIME = time.monotonic()
+RUNTIME_BUSY_SECONDS = REGISTRY.register(Counter(
+    "runtime_busy_seconds_total",
+    "Seconds the runtime spent running jobs, retried attempts included",
+    ("runtime",)
+))
+RUNTIME_IDLE_SECONDS = REGISTRY.register(Gauge(
+    "runtime_idle_seconds",
+    "Seconds since the server started that the runtime was not running a job",
+    lambda: {
+        (str(instance.runtime_id),): (
+            time.monotonic() - METRICS_START_TIME
+            - RUNTIME_BUSY_SECONDS.values().get((str(instance.runtime_id),), 0.0)
+        )
+        for instance in RUNTIME_INSTANCES
+    },
+    ("runtime",)
+))
+RUNTIME_RETRIES = REGISTRY.register(Counter(
+    "runtime_retries_total",
+    "Runs the runtime returned -1 for, which are retried on another runtime",
+    ("runtime", "mode")
+))
+JOB_QUEUE_SECONDS = REGISTRY.register(Histogram(
+    "job_queue_seconds",
+    "Seconds from submitting a run until a runtime or the simulator started it",
+    ("mode",)
+))
+JOB_RUN_SECONDS = REGISTRY.register(Histogram(
+    "job_run_seconds",
+    "Seconds from the start of a run until its result",
+    ("mode",)
+))
+
 
-async def run_job(job: str, mode: str) -> web.Response:
+def validate_job(
+    job: Union[None, CompiledJob],
+    mode: str,
+    optimize: object = False,
+    priority: object = DEFAULT_PRIORITY
+) -> Union[None, dict]:
     """
-    Run the specified job
-    Returns a response based on the result
+    Check a parsed job, mode, optimize flag and priority. job is None if the
+    job string did not parse
+    Returns None if they are valid, otherwise the error to return to the client
     """
-    if not JOB_INPUT_REGEX.match(job):
+    if job is None:
         Logger.log_error("Invalid job string")
+        return {
+            "error": "Job string not in the valid format",
+            "expected_format": "{Axis}({Angle}}, {Axis}({Angle}), ... ",
+            "examples": [
+                "X(90), Y(180), X(90)",
+                "X(90)",
+            ]
+        }
+
+    if mode not in JOB_MODES:
+        Logger.log_error("Invalid job mode selected string")
+        return {
+            "error": "Invalid Job Mode",
+            "expected": "verbatim, simulation, or echo",
+        }
+
+    if not isinstance(optimize, bool):
+        Logger.log_error("Invalid job optimize flag")
+        return {
+            "error": "Invalid optimize flag",
+            "expected": "true or false",
+        }
+
+    if not isinstance(priority, str) or priority not in PRIORITY_WEIGHTS:
+        Logger.log_error("Invalid job priority")
+        return {
+            "error": "Invalid priority",
+            "expected": ", ".join(PRIORITY_WEIGHTS),
+        }
+
+    return None
+
+
+def get_cached_result(job: CompiledJob, mode: str) -> Union[None, int]:
+    """
+    Return the cached return code of a job, None if it has to be run
+    """
+    if mode not in CACHEABLE_MODES:
+        return None
+    return RESULT_CACHE.get((job, mode))
+
+
+async def store_cached_job(
+    job: CompiledJob,
+    mode: str,
+    return_code: int,
+    optimized_job: Union[None, str] = None,
+    priority: str = DEFAULT_PRIORITY
+) -> int:
+    """
+    Store a job that was completed from the result cache
+    Returns the id of the job
+    """
+    with timed("storage"):
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                STORAGE_INSTANCE.add_cached_job,
+                str(job),
+                mode,
+                return_code,
+                None if return_code == 0 else Runtime.decode_error(return_code),
+                optimized_job=optimized_job,
+                priority=priority
+            )
+        )
+
+
+def prepare_job(
+    job: CompiledJob,
+    mode: str,
+    optimize: bool,
+    priority: str
+) -> Tuple[dict, CompiledJob]:
+    """
+    Optimize a valid job if that was asked for
+    Returns the response entry for the job, without an id, and the job to run
+    """
+    run = optimize_job(job) if optimize else job
+    return {
+        "id": None,
+        "mode": mode,
+        "job": str(job),
+        "optimized_job": str(run) if optimize else None,
+        "priority": priority,
+        "estimated_cost": None,
+    }, run
+
+
+def estimate_cost(job: CompiledJob, mode: str) -> Union[None, float]:
+    """
+    Return the expected runtime of a job that is going to be queued, None for
+    simulation jobs, which never take a runtime
+    """
+    if mode == "simulation":
+        return None
+    return COST_MODEL.estimate(job, mode)
+
+
+async def run_job(
+    job: Union[None, CompiledJob],
+    mode: str,
+    optimize: object = False,
+    priority: object = DEFAULT_PRIORITY
+) -> web.Response:
+    """
+    Run the specified job. job is None if the job string did not parse.
+    If optimize is set the optimized job is run instead
+    Returns a response based on the result
+    """
+    with timed("validation"):
+        job_error = validate_job(job, mode, optimize, priority)
+    if job_error:
         return web.json_response(
             status=400,
-            data={
-                "error": "Job string not in the valid format",
-                "expected_format": "{Axis}({Angle}}, {Axis}({Angle}), ... ",
-                "examples": [
-                    "X(90), Y(180), X(90)",
-                    "X(90)",
+            data=job_error
+        )
+
+    item, run = prepare_job(job, mode, optimize, priority)
+
+    cached_result = get_cached_result(run, mode)
+    if cached_result is not None:
+        item["id"] = await store_cached_job(
+            job,
+            mode,
+            cached_result,
+            item["optimized_job"],
+            priority
+        )
+    else:
+        # wait for the insert on an executor thread, so that concurrent
+        # submissions can share a commit without blocking the event loop
+        item["estimated_cost"] = estimate_cost(run, mode)
+        with timed("storage"):
+            item["id"] = await asyncio.get_running_loop().run_in_executor(
+                None,
+                functools.partial(
+                    STORAGE_INSTANCE.add_job,
+                    str(job),
+                    mode,
+                    optimized_job=item["optimized_job"],
+                    priority=priority,
+                    estimated_cost=item["estimated_cost"]
+                )
+            )
+
+        DISPATCHER.submit(
+            item["id"],
+            run,
+            mode,
+            priority,
+            item["estimated_cost"]
+        )
+
+    with timed("serialization"):
+        return web.json_response(
+            status=201,
+            data=item
+        )
+
+
+async def run_jobs(jobs: list) -> web.Response:
+    """
+    Run a batch of jobs, given as (parsed job, mode, optimize, priority) tuples
+    or None for entries that could not be read
+    Every valid job is stored in one transaction and queued in one step.
+    Returns a response with the id or the error of every entry, in order
+    """
+    items = []
+    queued = []
+    cached = []
+    with timed("validation"):
+        for entry in jobs:
+            if entry is None:
+                items.append({
+                    "error": "Batch entry malformed",
+                    "expected": "{\"job\": string, \"mode\": string}",
+                })
+                continue
+
+            job_error = validate_job(*entry)
+            if job_error:
+                items.append(job_error)
+                continue
+
+            item, run = prepare_job(*entry)
+            cached_result = get_cached_result(run, item["mode"])
+            if cached_result is None:
+                item["estimated_cost"] = estimate_cost(run, item["mode"])
+                queued.append((len(items), run))
+            else:
+                cached.append((len(items), cached_result))
+            items.append(item)
+
+    if queued or cached:
+        with timed("storage"):
+            job_ids = await asyncio.get_running_loop().run_in_executor(
+                None,
+                STORAGE_INSTANCE.add_jobs,
+                [
+                    (
+                        items[index]["job"],
+                        items[index]["mode"],
+                        items[index]["optimized_job"],
+                        items[index]["priority"],
+                        items[index]["estimated_cost"]
+                    )
+                    for index, _ in queued
+                ],
+                [
+                    (
+                        items[index]["job"],
+                        items[index]["mode"],
+                        cached_result,
+                        None if cached_result == 0
+                        else Runtime.decode_error(cached_result),
+                        items[index]["optimized_job"],
+                        items[index]["priority"]
+                    )
+                    for index, cached_result in cached
                 ]
-            }
+            )
+        if not job_ids:
+            return web.json_response(
+                status=500,
+                data={"error": "Jobs could not be stored"}
+            )
+
+        for (index, _), job_id in zip(queued + cached, job_ids):
+            items[index]["id"] = job_id
+
+    if queued:
+        DISPATCHER.submit_many(
+            (
+                items[index]["id"],
+                run,
+                items[index]["mode"],
+                items[index]["priority"],
+                items[index]["estimated_cost"]
+            )
+            for index, run in queued
         )
 
-    if mode not in ["verbatim", "simulation", "echo"]:
-        Logger.log_error("Invalid job mode selected string")
+    count = len(queued) + len(cached)
+    with timed("serialization"):
         return web.json_response(
-            status=400,
+            status=201 if count else 400,
             data={
-                "error": "Invalid Job Mode",
-                "expected": "verbatim, simulation, or echo",
+                "count": count,
+                "items": items
             }
         )
 
-    job_id = STORAGE_INSTANCE.add_job(job, mode)
 
-    job_thread = threading.Thread(
-        target=job_thread_handler,
-        daemon=False,
-        args=(job_id, job, mode)
-    )
-    job_thread.start()
+# this is only a record of the shared run and the jobs attached to it
+# pylint: disable=too-few-public-methods,too-many-instance-attributes
+class Execution:
+    """
+    A single run of a job on a runtime, shared by every identical job that was
+    submitted while it was queued or running
+    """
 
-    return web.json_response(
-        status=201,
-        data={
-            "id": job_id,
-            "mode": mode,
-            "job": job,
-        }
+    __slots__ = (
+        "job", "mode", "priority", "cost", "key", "job_ids", "runtime_id",
+        "submitted_time", "start_time"
     )
 
+    def __init__(
+        self,
+        job: CompiledJob,
+        mode: str,
+        job_id: int,
+        priority: str = DEFAULT_PRIORITY,
+        cost: Union[None, float] = None
+    ) -> None:
+        self.job = job
+        self.mode = mode
+        self.priority = priority
+        self.cost = cost
+        # runs of different priorities are kept apart, so an urgent job never
+        # waits in the queue of a bulk run
+        self.key = (job, mode, priority)
+        self.job_ids = [job_id]
+        self.runtime_id = None
+        self.submitted_time = time.monotonic()
+        # set when a runtime first starts the run
+        self.start_time = None
+
+    def attach(self, job_id: int) -> None:
+        """
+        Attach another job to this run. If the run has already started the job
+        is marked as started straight away
+        """
+        self.job_ids.append(job_id)
+        # simulation runs never get a runtime, they start with their batch
+        if self.runtime_id is not None or (
+            self.mode == "simulation" and self.start_time is not None
+        ):
+            STORAGE_INSTANCE.update_job(
+                job_id,
+                "Started",
+                self.runtime_id,
+                mode=self.mode
+            )
+
 
-def job_thread_handler(job_id: int, job: str, mode: str):
+def admit_job(
+    job_id: int,
+    job: CompiledJob,
+    mode: str,
+    priority: str = DEFAULT_PRIORITY,
+    estimated_cost: Union[None, float] = None
+) -> Union[None, tuple]:
     """
-    This method is intended to run in its own thread.
+    Called by the dispatcher, on its loop, for every submitted job.
+    Attaches the job to an identical run that is queued or running, otherwise
+    starts a new run. Simulation runs go to the simulator, other runs are
+    returned for the dispatcher to queue
+    """
+    execution = Execution(job, mode, job_id, priority, estimated_cost)
+    if mode in COALESCE_MODES:
+        shared = IN_FLIGHT.get(execution.key)
+        if shared:
+            shared.attach(job_id)
+            return None
+        IN_FLIGHT[execution.key] = execution
+
+    if mode == "simulation":
+        SIMULATOR.add(execution, job)
+        return None
+
+    return (execution,)
+
+
+async def job_handler(execution: Execution):
+    """
+    This coroutine is run by the dispatcher for every queued run.
     This method starts the job on the runtime, waits for it to complete,
-    then updates the status of the job in storage
+    then updates the status of every job attached to the run in storage
+    """
+    try:
+        runtime_result = await run_execution(execution)
+
+    except Exception:
+        fail_execution(execution)
+        raise
+
+    finish_execution(execution, runtime_result)
+
+
+def release_execution(execution: Execution) -> None:
+    """
+    Stop attaching new jobs to a run, later identical jobs need a run of their
+    own
     """
+    if IN_FLIGHT.get(execution.key) is execution:
+        del IN_FLIGHT[execution.key]
 
-    is_started = False
-    runtime_id = None
+
+def fail_execution(execution: Execution) -> None:
+    """
+    Give every job attached to a run that raised a final error status, so no
+    request or stream keeps waiting for it. The result is not cached
+    """
+    release_execution(execution)
+
+    for job_id in execution.job_ids:
+        STORAGE_INSTANCE.update_job(
+            job_id,
+            "Runtime Error",
+            execution.runtime_id,
+            RUN_ERROR,
+            Runtime.decode_error(RUN_ERROR),
+            mode=execution.mode
+        )
+
+
+def start_simulation(execution: Execution) -> None:
+    """
+    Called by the simulator when the batch of a simulation run is simulated or
+    sent to the worker processes. Marks every job attached to the run as
+    started
+    """
+    execution.start_time = time.monotonic()
+    JOB_QUEUE_SECONDS.observe(
+        execution.start_time - execution.submitted_time,
+        execution.mode
+    )
+
+    for job_id in execution.job_ids:
+        STORAGE_INSTANCE.update_job(
+            job_id,
+            "Started",
+            mode=execution.mode
+        )
+
+
+def finish_execution(execution: Execution, runtime_result: int) -> None:
+    """
+    Record the result of a run for every job attached to it
+    """
+    release_execution(execution)
+
+    if execution.mode in CACHEABLE_MODES:
+        RESULT_CACHE.put((execution.job, execution.mode), runtime_result)
+
+    JOB_RUN_SECONDS.observe(
+        time.monotonic() - (execution.start_time or execution.submitted_time),
+        execution.mode
+    )
+
+    status = "Success" if runtime_result == 0 else "Runtime Error"
+
+    for job_id in execution.job_ids:
+        STORAGE_INSTANCE.update_job(
+            job_id,
+            status,
+            execution.runtime_id,
+            runtime_result,
+            None if runtime_result == 0 else Runtime.decode_error(runtime_result),
+            mode=execution.mode
+        )
+
+
+async def run_execution(execution: Execution) -> int:
+    """
+    Run the job of an execution on the first free runtime, retrying until a
+    runtime accepts it
+    Returns the return code from the runtime
+    """
+    job = execution.job
+    mode = execution.mode
 
     # loop until the job has been started
-    while not is_started:
-        # search for a runtime that is available
-        for instance in RUNTIME_INSTANCES:
-            runtime_id = instance.runtime_id
-            if instance.get_is_available():
+    while True:
+        # waits until the pool hands out a free runtime
+        instance = await RUNTIME_POOL.acquire()
+
+        # the runtime can still be busy with work from outside this pool
+        if not instance.get_is_available():
+            RUNTIME_POOL.release(instance, is_available=False)
+            continue
+
+        execution.runtime_id = instance.runtime_id
+        start_time = time.monotonic()
+        if execution.start_time is None:
+            execution.start_time = start_time
+            JOB_QUEUE_SECONDS.observe(
+                start_time - execution.submitted_time,
+                mode
+            )
+
+        for job_id in execution.job_ids:
+            STORAGE_INSTANCE.update_job(
+                job_id,
+                "Started",
+                execution.runtime_id,
+                mode=mode
+            )
+
+        runtime_result = None
+        try:
+            if mode == "verbatim":
+                runtime_result = await instance.execute_async(job)
+            elif mode == "simulation":
+                runtime_result = await instance.simulate_async(job)
+            else:
+                runtime_result = await instance.echo_async(job)
+
+        finally:
+            run_time = time.monotonic() - start_time
+            RUNTIME_BUSY_SECONDS.inc(str(instance.runtime_id), amount=run_time)
+            # a runtime that could not start the job is handed out again after
+            # the retry delay, one that raised goes back straight away
+            RUNTIME_POOL.release(
+                instance,
+                is_available=runtime_result is None or runtime_result >= 0
+            )
+
+        if runtime_result < 0:
+            RUNTIME_RETRIES.inc(str(instance.runtime_id), mode)
+            execution.runtime_id = None
+            for job_id in execution.job_ids:
                 STORAGE_INSTANCE.update_job(
                     job_id,
-                    "Started",
-                    runtime_id
+                    "Retrying",
+                    mode=mode
                 )
-                if mode == "verbatim":
-                    runtime_result = instance.execute(job)
-                elif mode == "simulation":
-                    runtime_result = instance.simulate(job)
-                elif mode == "echo":
-                    runtime_result = instance.echo(job)
-                if runtime_result < 0:
-                    STORAGE_INSTANCE.update_job(
-                        job_id,
-                        "Retrying"
-                    )
-                else:
-                    is_started = True
-                    break
+        else:
+            COST_MODEL.observe(job, mode, run_time)
+            return runtime_result
 
-        # if none of the runtimes are available just sleep before trying again
-        if not is_started:
-            time.sleep(1)
 
-    status = "Success" if runtime_result == 0 else "Runtime Error"
+def create_simulation_pool() -> ProcessPoolExecutor:
+    """
+    Start the worker processes that simulation batches are run on. They are
+    started with spawn, forking the threads of the server is not safe
+    """
+    return ProcessPoolExecutor(
+        max_workers=SIMULATION_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
 
-    STORAGE_INSTANCE.update_job(
-        job_id,
-        status,
-        runtime_id,
-        runtime_result,
-        None if runtime_result == 0 else Runtime.decode_error(runtime_result)
+# one worker per runtime, more workers would only wait for a free runtime.
+# Simulation runs never take a runtime, they are collected by the simulator and
+# simulated in batches
+SIMULATOR = SimulationBatcher(
+    finish_execution,
+    create_simulation_pool() if SIMULATION_PROCESSES else None,
+    max(SIMULATION_PROCESSES, 1),
+    on_start=start_simulation,
+    executor_factory=create_simulation_pool if SIMULATION_PROCESSES else None
+)
+DISPATCHER = Dispatcher(
+    len(RUNTIME_INSTANCES),
+    job_handler,
+    admit_job,
+    SIMULATOR.drain,
+    lambda: FairQueue(
+        PRIORITY_WEIGHTS,
+        lambda args: args[0].priority,
+        PRIORITY_MAX_WAIT,
+        (lambda args: args[0].cost or 0.0) if SCHEDULING_POLICY == "sjf" else None,
+        SJF_AGING,
+        aged_interval=PRIORITY_AGED_INTERVAL
     )
+)
 
+JOB_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "job_queue_depth",
+    "Runs waiting in the dispatcher queue for a runtime",
+    lambda: {(): DISPATCHER.queue_depth()}
+))
 
-async def view_job(request: web.Request, job_id: int) -> web.Response:
+
+async def view_job(request: web.Request) -> web.Response:
     """
-    Retrieves all of the info for the specified job from storage
+    Retrieves all of the info for the specified job from storage.
+    With the wait query parameter the request is held open until the job
+    reaches a final status, or for at most that many seconds
     """
-    if request.method != "GET":
+    job_id = request.match_info["job_id"]
+
+    try:
+        wait = float(request.query.get("wait", 0))
+    except ValueError:
+        wait = -1
+
+    # also rejects nan
+    if not 0 <= wait <= VIEW_MAX_WAIT:
         Logger.log_error(
-            f"User tried to {request.method} to {request.path_qs}. Only POST requests are allowed"
+            f"User tried to view a job with an invalid wait @ {request.path_qs}"
         )
         return web.json_response(
             status=400,
             data={
-                "error":
-                "Only GET requests are allowed on this route"
+                "error": "Invalid wait parameter",
+                "expected": f"0 <= wait <= {VIEW_MAX_WAIT}",
             }
         )
 
-    job_data = STORAGE_INSTANCE.get_job(job_id)
+    if not wait:
+        with timed("storage"):
+            job_data = STORAGE_INSTANCE.get_job(job_id)
+        with timed("serialization"):
+            return web.json_response(
+                status=200,
+                data=job_data
+            )
+
+    # start listening before reading the job, so that an update committed in
+    # between is not missed
+    job_id = int(job_id)
+    future = JOB_EVENTS.add_waiter(job_id)
+    try:
+        with timed("storage"):
+            job_data = STORAGE_INSTANCE.get_job(job_id)
+        if job_data and job_data["status"] not in FINAL_STATUSES:
+            await asyncio.wait([future], timeout=wait)
+            with timed("storage"):
+                job_data = STORAGE_INSTANCE.get_job(job_id)
 
-    return web.json_response(
-        status=200,
-        data=job_data
-    )
+    finally:
+        JOB_EVENTS.remove_waiter(job_id, future)
+
+    with timed("serialization"):
+        return web.json_response(
+            status=200,
+            data=job_data
+        )
 
 
 async def list_jobs(request: web.Request) -> web.Response:
     """
-    Retrieves all of the jobs from storage
-    TODO: add pagination
+    Retrieves a page of jobs from storage.
+    Pages are selected with the after_id and limit query parameters, the next
+    field of the response is the after_id of the following page
     """
-    if request.method != "GET":
+    try:
+        after_id = int(request.query.get("after_id", 0))
+        limit = int(request.query.get("limit", LIST_DEFAULT_LIMIT))
+    except ValueError:
+        after_id = limit = -1
+
+    if after_id < 0 or not 0 < limit <= LIST_MAX_LIMIT:
         Logger.log_error(
-            f"User tried to {request.method} to {request.path_qs}. Only POST requests are allowed"
+            f"User tried to list jobs with invalid paging @ {request.path_qs}"
         )
         return web.json_response(
             status=400,
             data={
-                "error":
-                "Only GET requests are allowed on this route"
+                "error": "Invalid pagination parameters",
+                "expected": f"after_id >= 0 and 0 < limit <= {LIST_MAX_LIMIT}",
             }
         )
 
-    job_rows = STORAGE_INSTANCE.list_jobs()
+    with timed("storage"):
+        job_rows = STORAGE_INSTANCE.list_jobs(after_id, limit)
 
-    return web.json_response(
+    with timed("serialization"):
+        return web.json_response(
+            status=200,
+            data={
+                "count": len(job_rows),
+                "rows": job_rows,
+                "next": job_rows[-1]["id"] if len(job_rows) == limit else None
+            }
+        )
+
+
+async def export_jobs(request: web.Request) -> web.StreamResponse:
+    """
+    Streams every job in storage as newline delimited JSON, one job per line.
+    Rows are read from storage in chunks on an executor thread and written to
+    the client as they arrive, so memory use stays constant
+    """
+    response = web.StreamResponse(
         status=200,
-        data={
-            "count": len(job_rows),
-            "rows": job_rows
-        }
+        headers={"Content-Type": "application/x-ndjson"}
     )
+    await response.prepare(request)
 
+    loop = asyncio.get_running_loop()
+    chunks = STORAGE_INSTANCE.iter_jobs(EXPORT_CHUNK_SIZE)
+    fetch = None
+    try:
+        while True:
+            with timed("storage"):
+                # shielded, so a disconnect leaves the fetch to finish on the
+                # executor instead of abandoning it
+                fetch = loop.run_in_executor(None, next, chunks, None)
+                chunk = await asyncio.shield(fetch)
+            if not chunk:
+                break
+            with timed("serialization"):
+                lines = "".join(json.dumps(job) + "\n" for job in chunk)
+            await response.write(lines.encode("utf8"))
+    finally:
+        # release the cursor even if the client disconnected mid stream. The
+        # generator can not be closed while a fetch is still running it
+        if fetch is not None and not fetch.done():
+            await asyncio.wait([fetch])
+        chunks.close()
 
-async def add_job(request: web.Request) -> web.Response:
+    await response.write_eof()
+    return response
+
+
+def read_list_parameter(
+    request: web.Request,
+    name: str
+) -> Union[None, list]:
     """
-    Adds a job to the runtime if the request is valid
-    Returns the response that should be returned to the client
+    Return the comma separated values of a query parameter, None if it is not
+    set
+    """
+    value = request.query.get(name)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(",")]
+
+
+def read_stream_filters(request: web.Request) -> tuple:
+    """
+    Read the job ids, modes and statuses a stream is limited to, None for the
+    ones that are not set. Raises ValueError if a value is invalid
+    """
+    job_ids = read_list_parameter(request, "id")
+    modes = read_list_parameter(request, "mode")
+    statuses = read_list_parameter(request, "status")
+
+    if job_ids is not None:
+        job_ids = {int(job_id) for job_id in job_ids}
+    if modes is not None:
+        modes = {mode.lower() for mode in modes}
+        if not modes.issubset(JOB_MODES):
+            raise ValueError(modes)
+    if statuses is not None:
+        statuses = set(statuses)
+        if not statuses.issubset(UPDATE_STATUSES):
+            raise ValueError(statuses)
+
+    return job_ids, modes, statuses
+
+
+def format_event(event: str, data: dict) -> bytes:
+    """
+    Encode a server-sent event
     """
-    if request.method != "POST":
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf8")
+
+
+async def stream_jobs(request: web.Request) -> web.StreamResponse:
+    """
+    Streams every job status update as server-sent events, optionally only the
+    updates of some job ids, modes or statuses.
+    Every update is an "update" event. If the client reads too slowly updates
+    are dropped, and a "dropped" event with their count follows the updates
+    that were kept
+    """
+    try:
+        filters = read_stream_filters(request)
+
+    except ValueError:
         Logger.log_error(
-            f"User tried to {request.method} to {request.path_qs}. Only POST requests are allowed"
+            f"User tried to stream jobs with invalid filters @ {request.path_qs}"
         )
         return web.json_response(
             status=400,
             data={
-                "error":
-                "Only POST requests are allowed on this route"
+                "error": "Invalid stream filter",
+                "expected": {
+                    "id": "comma separated job ids",
+                    "mode": ", ".join(JOB_MODES),
+                    "status": ", ".join(UPDATE_STATUSES),
+                },
             }
         )
 
+    response = web.StreamResponse(
+        status=200,
+        headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        }
+    )
+    await response.prepare(request)
+
+    subscriber = Subscriber(*filters, STREAM_QUEUE_SIZE)
+    JOB_STREAM.subscribe(subscriber)
+    try:
+        while True:
+            try:
+                update = await asyncio.wait_for(
+                    subscriber.queue.get(),
+                    STREAM_KEEPALIVE
+                )
+            except asyncio.TimeoutError:
+                await response.write(b": keepalive\n\n")
+                continue
+
+            await response.write(format_event("update", update))
+
+            # updates are only dropped while the queue is full, so they are
+            # newer than every update in it
+            if subscriber.queue.empty():
+                dropped = subscriber.take_dropped()
+                if dropped:
+                    await response.write(
+                        format_event("dropped", {"count": dropped})
+                    )
+
+    except ConnectionResetError:
+        Logger.log_info(f"Client closed the stream @ {request.path_qs}")
+
+    finally:
+        JOB_STREAM.unsubscribe(subscriber)
+
+    return response
+
+
+async def read_json_body(
+    request: web.Request
+) -> Tuple[object, Union[None, web.Response]]:
+    """
+    Read and decode the JSON body of a request
+    Returns the decoded body, or the error response to return to the client
+    """
     if not request.body_exists:
         Logger.log_error(
             f"User tried to add an entry without a request body @ {request.path_qs}"
         )
-        return web.json_response(
+        return None, web.json_response(
             status=400,
             data={
                 "error":
@@ -216,14 +987,15 @@ async def add_job(request: web.Request) -> web.Response:
     request_body = await request.text()
 
     try:
-        request_json = json.loads(request_body)
+        with timed("validation"):
+            request_json = json.loads(request_body)
     except json.decoder.JSONDecodeError:
         Logger.log_error(
             "User tried to add a job with a malformed request body"
             f" @ {request.path_qs}."
             f" Request body: {request_body}"
         )
-        return web.json_response(
+        return None, web.json_response(
             status=400,
             data={
                 "error": "Request body malformed",
@@ -232,69 +1004,200 @@ async def add_job(request: web.Request) -> web.Response:
             }
         )
 
-    job_input_str = request_json.get("job", "").upper()
+    return request_json, None
+
+
+async def add_job(request: web.Request) -> web.Response:
+    """
+    Adds a job to the runtime if the request is valid
+    Returns the response that should be returned to the client
+    """
+    request_json, error_response = await read_json_body(request)
+    if error_response:
+        return error_response
+
+    with timed("validation"):
+        job = parse_job(request_json.get("job", ""))
 
     job_mode = request_json.get("mode", "").lower()
 
-    return await run_job(job_input_str, job_mode)
+    return await run_job(
+        job,
+        job_mode,
+        request_json.get("optimize", False),
+        request_json.get("priority", DEFAULT_PRIORITY)
+    )
+
+
+async def add_jobs(request: web.Request) -> web.Response:
+    """
+    Adds a batch of jobs to the runtime. The body is a list of objects in the
+    same format as the body of /jobs/add/
+    Returns the response that should be returned to the client
+    """
+    request_json, error_response = await read_json_body(request)
+    if error_response:
+        return error_response
+
+    if not isinstance(request_json, list) or not request_json:
+        Logger.log_error(
+            f"User tried to add a batch that is not a list @ {request.path_qs}"
+        )
+        return web.json_response(
+            status=400,
+            data={
+                "error": "Batch must be a non-empty list of jobs",
+                "expected": "[{\"job\": string, \"mode\": string}, ...]",
+            }
+        )
+
+    if len(request_json) > BATCH_MAX_SIZE:
+        Logger.log_error(
+            f"User tried to add a batch of {len(request_json)} jobs"
+            f" @ {request.path_qs}"
+        )
+        return web.json_response(
+            status=400,
+            data={
+                "error": "Batch too large",
+                "max_size": BATCH_MAX_SIZE,
+            }
+        )
 
+    jobs = []
+    with timed("validation"):
+        for entry in request_json:
+            try:
+                jobs.append((
+                    parse_job(entry.get("job", "")),
+                    entry.get("mode", "").lower(),
+                    entry.get("optimize", False),
+                    entry.get("priority", DEFAULT_PRIORITY)
+                ))
+            except AttributeError:
+                jobs.append(None)
 
-ROOT_REGEX = re.compile(r"^\/jobs(\/|\?)$")
-ADD_REGEX = re.compile(r"^\/jobs/add(\/$|\?|$)")
-LIST_REGEX = re.compile(r"^\/jobs/list(\/$|\?|$)")
-VIEW_REGEX = re.compile(r"^\/jobs/(\d+)(\/$|\?|$)")
+    return await run_jobs(jobs)
 
 
-async def router(request: web.Request) -> web.Response:
+async def select_function(_request: web.Request) -> web.Response:
     """
-    Route the job request to the appropriate handler funcion
+    Handles requests to /jobs/ itself
     """
-    try:
-        api_header = request.headers.get("api_key", None)
-        if not api_header:
-            return web.json_response(
-                status=401,
-                data={
-                    "error": "api_key header cannot be empty"
-                }
-            )
-        if api_header != API_KEY:
-            return web.json_response(
-                status=403,
-                data={
-                    "error": "Invalid api_key header"
-                }
-            )
+    return web.json_response(
+        status=400,
+        data={
+            "error": "Please select a function under the jobs endpoint"
+        }
+    )
 
-        request_path = request.path
 
-        if ROOT_REGEX.match(request_path):
-            return web.json_response(
-                status=400,
-                data={
-                    "error": "Please select a function under the jobs endpoint"
-                }
-            )
+async def function_not_defined(_request: web.Request) -> web.Response:
+    """
+    Handles requests to paths under /jobs/ that no route matches
+    """
+    return web.json_response(
+        status=404,
+        data={
+            "error": "Not Found",
+            "note": "This function is not defined",
+        }
+    )
 
-        if ADD_REGEX.match(request_path):
-            return await add_job(request)
-        if LIST_REGEX.match(request_path):
-            return await list_jobs(request)
-        view_match = VIEW_REGEX.match(request_path)
-        if view_match:
-            return await view_job(request, view_match.group(1))
 
+def only_allowed(method: str) -> Callable[[web.Request], Awaitable]:
+    """
+    Return a handler that rejects the requests to a route that do not use
+    method
+    """
+    async def reject(request: web.Request) -> web.Response:
+        Logger.log_error(
+            f"User tried to {request.method} to {request.path_qs}."
+            f" Only {method} requests are allowed"
+        )
         return web.json_response(
-            status=404,
+            status=400,
             data={
-                "error": "Not Found",
-                "note": "This function is not defined",
+                "error":
+                f"Only {method} requests are allowed on this route"
             }
         )
 
+    return reject
+
+
+@web.middleware
+async def check_api_key(
+    request: web.Request,
+    handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    """
+    Rejects requests without a valid api_key header before they reach a
+    handler, including requests to functions that are not defined
+    """
+    try:
+        with timed("auth"):
+            api_header = request.headers.get("api_key", None)
+            if not api_header:
+                return web.json_response(
+                    status=401,
+                    data={
+                        "error": "api_key header cannot be empty"
+                    }
+                )
+            if api_header != API_KEY:
+                return web.json_response(
+                    status=403,
+                    data={
+                        "error": "Invalid api_key header"
+                    }
+                )
+
+        return await handler(request)
+
     except Exception as exc:
         Logger.log_exception(
-            "Exeption caught in jobs.router function",
+            "Exeption caught in jobs.check_api_key middleware",
             exc
         )
         raise
+
+
+# path under /jobs, the one method it accepts ("*" for all) and its handler.
+# Every path except the root is also served with a trailing slash.
+# The last routes catch every other path, /jobs itself included, so that no
+# request falls through to the slower not found handling of aiohttp
+ROUTES = [
+    ("/", "*", select_function),
+    ("/add", "POST", add_job),
+    ("/add/batch", "POST", add_jobs),
+    ("/list", "GET", list_jobs),
+    ("/export", "GET", export_jobs),
+    ("/stream", "GET", stream_jobs),
+    (r"/{job_id:\d+}", "GET", view_job),
+    ("", "*", function_not_defined),
+    ("/{tail:.*}", "*", function_not_defined),
+]
+
+
+def create_app() -> web.Application:
+    """
+    Build the application that serves /jobs/. Requests are matched by
+    aiohttp's route table, and requests with any other method get the
+    "Only ... requests are allowed" response of the route
+    """
+    app = web.Application(middlewares=[check_api_key])
+    for path, method, handler in ROUTES:
+        if method == "*":
+            paths = [path]
+        else:
+            paths = [path, path + "/"]
+        for route_path in paths:
+            resource = app.router.add_resource(route_path)
+            if method == "*":
+                resource.add_route("*", handler)
+            else:
+                resource.add_route(method, handler)
+                resource.add_route("*", only_allowed(method))
+
+    return app
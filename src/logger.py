@@ -3,18 +3,202 @@
 """
 General logging file. The built-in python logger or an external service can be
 used by just replacing the funcitons in this file
+
+Log records are not written by the caller. They are put on a bounded buffer and
+written in batches by a background thread that keeps the log files open, so
+logging does not add file I/O to request handling
 """
 
 # default modules
+import atexit
 import datetime
+import queue
+import threading
 import traceback
 
+# custom modules
+from batch_queue import get_batch
+
 # pylint: disable=fixme
 # TODO: these relative paths are non-ideal, change format or logging setup
 ALL_LOGS = "../logs/all.log"
 ERROR_LOGS = "../logs/error.log"
 EXCEPTION_LOGS = "../logs/exception.log"
 
+# maximum number of records waiting to be written
+LOG_BUFFER_SIZE = 10000
+# maximum number of records written at a time
+LOG_BATCH_SIZE = 500
+# maximum number of seconds a record waits before it is written
+LOG_FLUSH_INTERVAL = 0.2
+# what to do when the buffer is full: "drop" the record or "block" the caller
+LOG_OVERFLOW_POLICY = "drop"
+
+
+# the writer needs its settings as well as its buffer, thread and file state
+# pylint: disable=too-many-instance-attributes
+class LogWriter:
+    """
+    This class owns the log buffer and the thread that writes it to disk
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = LOG_BUFFER_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        overflow_policy: str = LOG_OVERFLOW_POLICY
+    ) -> None:
+        self.records = queue.Queue(maxsize=buffer_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.files = {}
+        self.is_closed = False
+        self.thread = None
+        self.lock = threading.Lock()
+        # the writer thread holds lock while it writes to disk, so dropped
+        # records are counted under a lock of their own
+        self.dropped = 0
+        self.dropped_lock = threading.Lock()
+
+    def write(self, entry: str, file_path: str) -> None:
+        """
+        Queue an entry to be appended to file_path. This returns immediately
+        unless the buffer is full and the overflow policy is "block"
+        """
+        if self.is_closed or (not self.thread and not self.start()):
+            # the writer is gone after shutdown, write late records directly
+            with self.lock:
+                self.write_batch([(file_path, entry)])
+                self.close_files()
+            return
+
+        if self.overflow_policy == "block":
+            self.records.put((file_path, entry))
+            return
+
+        try:
+            self.records.put_nowait((file_path, entry))
+        except queue.Full:
+            self.count_dropped()
+
+    def count_dropped(self) -> None:
+        """
+        Count a record that was not written
+        """
+        with self.dropped_lock:
+            self.dropped += 1
+
+    def take_dropped(self) -> int:
+        """
+        Return the number of records dropped since the last call
+        """
+        with self.dropped_lock:
+            dropped = self.dropped
+            self.dropped = 0
+        return dropped
+
+    def start(self) -> bool:
+        """
+        Start the writer thread if it is not running yet
+
+        Return: False if the writer has been shut down
+        """
+        # checked under the lock shutdown takes, so a write racing shutdown
+        # can not bring the thread back
+        with self.lock:
+            if self.is_closed:
+                return False
+            if self.thread:
+                return True
+
+            self.thread = threading.Thread(
+                target=self.run,
+                name="log-writer",
+                daemon=True
+            )
+            self.thread.start()
+            return True
+
+    def shutdown(self) -> None:
+        """
+        Write every queued record, close the log files and stop the writer
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+            self.is_closed = True
+
+        if thread:
+            self.records.put(None)
+            thread.join()
+
+    def run(self) -> None:
+        """
+        Body of the writer thread. Collects records until the batch is full or
+        the flush interval has passed, then writes them all at once
+        """
+        is_running = True
+        while is_running:
+            batch, is_stopped = get_batch(
+                self.records,
+                self.batch_size,
+                self.flush_interval
+            )
+            is_running = not is_stopped
+
+            dropped = self.take_dropped()
+            if dropped:
+                batch.append((
+                    ERROR_LOGS,
+                    f"ERROR [{get_timestamp()}]:"
+                    f" {dropped} log records dropped\n"
+                ))
+
+            with self.lock:
+                self.write_batch(batch)
+
+        with self.lock:
+            self.close_files()
+
+    def write_batch(self, batch: list) -> None:
+        """
+        Append every (file_path, entry) record in the batch to its file
+        """
+        touched = set()
+        for file_path, entry in batch:
+            try:
+                log = self.files.get(file_path)
+                if log is None:
+                    # kept open until shutdown, so no with block here
+                    # pylint: disable=consider-using-with
+                    log = open(file_path, "a", encoding='utf8')
+                    self.files[file_path] = log
+                log.write(entry)
+                touched.add(log)
+
+            except OSError:
+                self.count_dropped()
+
+        for log in touched:
+            try:
+                log.flush()
+            except OSError:
+                pass
+
+    def close_files(self) -> None:
+        """
+        Close every open log file
+        """
+        for log in self.files.values():
+            log.close()
+        self.files = {}
+
+
+LOG_WRITER = LogWriter()
+atexit.register(LOG_WRITER.shutdown)
+
 
 def log_message(
     level: str,
@@ -26,8 +210,14 @@ def log_message(
     Write message to supplied file path
     """
     entry = f"{level} [{timestamp}]: {message}\n"
-    with open(file_path, "a", encoding='utf8') as log:
-        log.write(entry)
+    LOG_WRITER.write(entry, file_path)
+
+
+def shutdown() -> None:
+    """
+    Flush every buffered record to disk. Call this before the server exits
+    """
+    LOG_WRITER.shutdown()
 
 
 def get_timestamp() -> str:
@@ -10,6 +10,20 @@ from aiohttp import web
 # custom modules
 import logger as Logger
 import router as Router
+import jobs as Jobs
+from storage import STORAGE_INSTANCE
+
+
+async def on_shutdown(_app: web.Application) -> None:
+    """
+    Let the dispatcher finish every accepted job, then commit the queued
+    writes and flush the logs before the server exits
+    """
+    Logger.log_info("Server shutdown, waiting for queued jobs")
+    Jobs.DISPATCHER.shutdown()
+    Jobs.SIMULATOR.shutdown()
+    STORAGE_INSTANCE.close()
+    Logger.shutdown()
 
 
 # start the server if this file is executed
@@ -17,8 +31,9 @@ if __name__ == '__main__':
     # this should be set in an environment variable
     LISTEN_PORT = 12021
 
-    APP = web.Application()
-    APP.add_routes([web.route('*', r'/{tail:.*}', Router.entry_point)])
+    APP = Router.create_app()
+    APP.on_shutdown.append(on_shutdown)
 
     Logger.log_info("Server startup")
+    STORAGE_INSTANCE.migrate()
     web.run_app(APP, port=LISTEN_PORT)
@@ -0,0 +1,275 @@
+#! /usr/bin/env python3
+"""
+Collects server metrics and renders them in the Prometheus text format.
+
+Counters and histograms are updated on the request and dispatcher threads, so
+updating them must be cheap. Every thread writes to a shard of its own, found
+through a thread local, and the shards are only summed when the metrics are
+rendered. An update takes no lock, only the first update of a thread takes one
+to register its shard.
+
+Gauges are read when the metrics are rendered, from a function that returns
+the current values
+"""
+
+# default modules
+import bisect
+import threading
+from typing import Callable, Dict, Iterable, Sequence, Tuple
+
+# default histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0, 60.0,
+)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """
+    Return the label set of a sample, e.g. {mode="echo"}
+    """
+    if not names:
+        return ""
+    labels = ",".join(
+        f'{name}="{escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + labels + "}"
+
+
+def escape(value: object) -> str:
+    """
+    Escape a label value
+    """
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+def format_value(value: float) -> str:
+    """
+    Return a sample value the way Prometheus writes it
+    """
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    Base of every metric: its name, help text, type and label names
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+    def render(self) -> Iterable[str]:
+        """
+        Yield the lines of the metric in the text format
+        """
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.samples()
+
+    def samples(self) -> Iterable[str]:
+        """
+        Yield the sample lines of the metric
+        """
+        return ()
+
+
+class ShardedMetric(Metric):
+    """
+    A metric whose values are kept in one dict per writing thread
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def shard(self) -> dict:
+        """
+        Return the shard of the calling thread
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards.append(shard)
+            return shard
+
+    def snapshot(self) -> Iterable[Tuple[tuple, object]]:
+        """
+        Yield the (labels, value) entries of every shard
+        """
+        with self.lock:
+            shards = list(self.shards)
+        for shard in shards:
+            # copied in one step, the owning thread may add entries meanwhile
+            yield from list(shard.items())
+
+
+class Counter(ShardedMetric):
+    """
+    A value that only goes up
+    """
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+        Add amount to the counter of the label values
+        """
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def values(self) -> Dict[tuple, float]:
+        """
+        Return the total of every label set
+        """
+        totals = {}
+        for labels, value in self.snapshot():
+            totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values().items()):
+            yield (
+                f"{self.name}{format_labels(self.label_names, labels)}"
+                f" {format_value(value)}"
+            )
+
+
+class Histogram(ShardedMetric):
+    """
+    Counts observations in buckets of upper bounds
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        Record an observation for the label values
+        """
+        shard = self.shard()
+        # a count per bucket, the last one above every bound, then the sum
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def values(self) -> Dict[tuple, list]:
+        """
+        Return the bucket counts and sum of every label set
+        """
+        totals = {}
+        for labels, entry in self.snapshot():
+            total = totals.get(labels)
+            if total is None:
+                totals[labels] = list(entry)
+            else:
+                totals[labels] = [a + b for a, b in zip(total, entry)]
+        return totals
+
+    def samples(self) -> Iterable[str]:
+        bounds = self.buckets + (float("inf"),)
+        label_names = self.label_names + ("le",)
+        for labels, entry in sorted(self.values().items()):
+            count = 0
+            for bound, bucket_count in zip(bounds, entry):
+                count += bucket_count
+                bucket_labels = format_labels(
+                    label_names,
+                    labels + (format_value(bound),)
+                )
+                yield f"{self.name}_bucket{bucket_labels} {count}"
+
+            label_set = format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{label_set} {format_value(entry[-1])}"
+            yield f"{self.name}_count{label_set} {count}"
+
+
+class Gauge(Metric):
+    """
+    A value read when the metrics are rendered
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Dict[tuple, float]],
+        label_names: Sequence[str] = ()
+    ) -> None:
+        """
+        collect: returns the current value of every label set
+        """
+        super().__init__(name, documentation, label_names)
+        self.collect = collect
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.collect().items()):
+            yield (
+                f"{self.name}{format_labels(self.label_names, labels)}"
+                f" {format_value(value)}"
+            )
+
+
+class Registry:
+    """
+    The metrics exposed by the server
+    """
+
+    def __init__(self) -> None:
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Add a metric and return it
+        """
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text format
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
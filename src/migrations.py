@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+"""
+Versioned schema migrations for the job database.
+
+Every migration has a version number and is applied once, in its own
+transaction, when the server starts. The applied versions are recorded in the
+schema_version table.
+
+To change the schema append a new migration to MIGRATIONS. Never edit a
+migration that has already been released. Prefer changes SQLite can make in
+place, like CREATE INDEX or ALTER TABLE ... ADD COLUMN, so that existing
+databases are upgraded without rebuilding the job table
+"""
+
+# default modules
+import datetime
+import sqlite3
+
+SQL_CREATE_VERSION_TABLE = (
+    "CREATE TABLE IF NOT EXISTS schema_version ("
+    "   version INTEGER PRIMARY KEY,"
+    "   description TEXT,"
+    "   applied_time TEXT"
+    "); "
+)
+
+SQL_SELECT_VERSION = "SELECT COALESCE(MAX(version), 0) FROM schema_version"
+
+SQL_INSERT_VERSION = (
+    " INSERT INTO"
+    "    schema_version (version, description, applied_time)"
+    " VALUES"
+    "    (?,?,?)"
+)
+
+# (version, description, statements)
+MIGRATIONS = [
+    (
+        1,
+        "Create the job table",
+        [
+            # IF NOT EXISTS so databases created before migrations are adopted
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "   id INTEGER PRIMARY KEY,"
+            "   job TEXT NOT NULL,"
+            "   mode TEXT,"
+            "   status TEXT,"
+            "   runtime INTEGER,"
+            "   return_code INTEGER,"
+            "   runtime_error TEXT,"
+            "   created_time TEXT,"
+            "   start_time TEXT,"
+            "   end_time TEXT"
+            "); ",
+        ]
+    ),
+    (
+        2,
+        "Record jobs that were served from the result cache",
+        [
+            "ALTER TABLE jobs ADD COLUMN cached INTEGER NOT NULL DEFAULT 0",
+        ]
+    ),
+    (
+        3,
+        "Record the optimized form of jobs that were optimized",
+        [
+            "ALTER TABLE jobs ADD COLUMN optimized_job TEXT",
+        ]
+    ),
+    (
+        4,
+        "Record the priority class of every job",
+        [
+            "ALTER TABLE jobs ADD COLUMN priority TEXT NOT NULL DEFAULT 'normal'",
+        ]
+    ),
+    (
+        5,
+        "Record the estimated runtime of every job",
+        [
+            "ALTER TABLE jobs ADD COLUMN estimated_cost REAL",
+        ]
+    ),
+]
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    """
+    Return the schema version of the database, 0 if no migration was applied
+    """
+    connection.execute(SQL_CREATE_VERSION_TABLE)
+    return connection.execute(SQL_SELECT_VERSION).fetchone()[0]
+
+
+def apply_migrations(connection: sqlite3.Connection) -> int:
+    """
+    Apply every migration newer than the schema version of the database.
+    Each migration is applied in its own transaction, so a failed migration
+    leaves the database at the previous version
+
+    Return: the schema version of the database after the migrations
+    """
+    version = get_version(connection)
+    for migration_version, description, statements in MIGRATIONS:
+        if migration_version <= version:
+            continue
+
+        connection.execute("BEGIN")
+        try:
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(
+                SQL_INSERT_VERSION,
+                [
+                    migration_version,
+                    description,
+                    datetime.datetime.utcnow().isoformat()
+                ]
+            )
+            connection.commit()
+
+        except Exception:
+            connection.rollback()
+            raise
+
+        version = migration_version
+
+    return version
@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+"""
+Profiles the live server for a number of seconds.
+
+Two profilers are available:
+    - cprofile: deterministic profile of the event loop thread that serves the
+      requests, with the exact call counts and times of every function. It only
+      sees that thread, and slows it down while it runs
+    - sample: samples the stack of every thread at a fixed interval, so the
+      dispatcher, storage writer and log writer threads are seen as well. The
+      report lists the stacks by the number of samples they were seen in,
+      innermost frame last
+Only one profile should run at a time, see PROFILE_LOCK
+"""
+
+# default modules
+import asyncio
+import collections
+import cProfile
+import io
+import pstats
+import sys
+import threading
+
+# sort orders the cprofile report accepts
+CPROFILE_SORT_KEYS = ("cumulative", "tottime", "ncalls")
+
+# seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# held while a profile runs, so only one runs at a time
+PROFILE_LOCK = threading.Lock()
+
+
+async def profile_loop(
+    seconds: float,
+    sort: str = "cumulative",
+    limit: int = 50
+) -> str:
+    """
+    Profile the calling event loop thread with cProfile for seconds
+
+    Return: the pstats report of the limit most expensive functions
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats(sort).print_stats(limit)
+    return report.getvalue()
+
+
+def format_frame(frame) -> str:
+    """
+    Return function (file:line) of a frame
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(stop: threading.Event, interval: float) -> tuple:
+    """
+    Sample the stack of every other thread until stop is set
+
+    Return: the number of samples and a Counter of (thread name, stack)
+    """
+    names = {}
+    stacks = collections.Counter()
+    samples = 0
+    own_id = threading.get_ident()
+    while not stop.wait(interval):
+        samples += 1
+        # the lookup is cheap, only new threads need their name
+        # pylint: disable=protected-access
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+
+            if thread_id not in names:
+                names = {
+                    thread.ident: thread.name for thread in threading.enumerate()
+                }
+
+            stack = []
+            while frame is not None:
+                stack.append(format_frame(frame))
+                frame = frame.f_back
+            stack.reverse()
+            stacks[(names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+
+    return samples, stacks
+
+
+async def sample_threads(seconds: float, limit: int = 50) -> str:
+    """
+    Sample the stacks of every thread for seconds
+
+    Return: a report of the limit most common stacks
+    """
+    stop = threading.Event()
+    loop = asyncio.get_running_loop()
+    sampler = loop.run_in_executor(None, sample_stacks, stop, SAMPLE_INTERVAL)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+    samples, stacks = await sampler
+
+    lines = [
+        f"{samples} samples every {SAMPLE_INTERVAL * 1000:g} ms over"
+        f" {seconds:g} s, most common stacks first"
+    ]
+    for (thread_name, stack), count in stacks.most_common(limit):
+        lines.append("")
+        lines.append(
+            f"{count} samples ({count / max(samples, 1):.1%}) in {thread_name}"
+        )
+        lines.extend(f"    {frame}" for frame in stack)
+    return "\n".join(lines) + "\n"
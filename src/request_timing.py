@@ -0,0 +1,75 @@
+#! /usr/bin/env python3
+"""
+Times the phases of a request.
+
+The request middleware puts a RequestTimer in a context variable for the
+duration of the request. Code on the request path wraps its work in
+timed(phase), which adds the time spent to that phase of the current request.
+Outside a request, e.g. on the dispatcher thread, timed does nothing but read
+the context variable, so it is safe to use anywhere.
+
+The phases are sent back in the Server-Timing header, see
+https://www.w3.org/TR/server-timing/, and recorded as metrics
+"""
+
+# default modules
+import contextvars
+import time
+
+# the timer of the request being handled, None outside a request
+CURRENT_TIMER = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """
+    The seconds a request spent in each phase
+    """
+
+    __slots__ = ("start_time", "phases")
+
+    def __init__(self) -> None:
+        self.start_time = time.perf_counter()
+        self.phases = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        """
+        Add seconds to a phase
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """
+        Return the value of the Server-Timing header: every phase so far and
+        the total time, in milliseconds
+        """
+        total = time.perf_counter() - self.start_time
+        metrics = [
+            f"{phase};dur={seconds * 1000:.3f}"
+            for phase, seconds in self.phases.items()
+        ]
+        metrics.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+# a class rather than a generator based context manager, which costs several
+# times as much on every use
+# pylint: disable=invalid-name,too-few-public-methods
+class timed:
+    """
+    Add the time spent in the with block to a phase of the current request
+    """
+
+    __slots__ = ("phase", "timer", "start_time")
+
+    def __init__(self, phase: str) -> None:
+        self.phase = phase
+        self.timer = CURRENT_TIMER.get()
+        self.start_time = 0.0
+
+    def __enter__(self) -> None:
+        if self.timer is not None:
+            self.start_time = time.perf_counter()
+
+    def __exit__(self, *_exc_info) -> None:
+        if self.timer is not None:
+            self.timer.add(self.phase, time.perf_counter() - self.start_time)
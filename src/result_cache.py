@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+"""
+Caches the return codes of deterministic jobs.
+
+Simulation and echo jobs always return the same code for the same job string,
+so a cached result can be used instead of holding a runtime for the job.
+The cache is bounded in size, evicts the least recently used entry first and
+expires entries after a fixed time to live
+"""
+
+# default modules
+import collections
+import threading
+import time
+from typing import Hashable, Union
+
+
+class ResultCache:
+    """
+    Size bounded LRU cache with a time to live. Safe to use from any thread
+    """
+
+    def __init__(self, max_size: int = 0, ttl: float = 300) -> None:
+        """
+        max_size: maximum number of cached results, 0 disables the cache
+        ttl: seconds a result stays valid after it was stored
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def is_enabled(self) -> bool:
+        """
+        True if results are cached at all
+        """
+        return self.max_size > 0
+
+    def get(self, key: Hashable) -> Union[None, int]:
+        """
+        Return the cached result for key, None if there is no valid entry
+        """
+        if not self.is_enabled:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            result, expiry_time = entry
+            if expiry_time <= time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return result
+
+    def put(self, key: Hashable, result: int) -> None:
+        """
+        Store the result for key, evicting the least recently used entry if the
+        cache is full
+        """
+        if not self.is_enabled:
+            return
+
+        with self.lock:
+            self.entries[key] = (result, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Remove every cached result
+        """
+        with self.lock:
+            self.entries.clear()
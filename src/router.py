@@ -1,13 +1,15 @@
 #! /usr/bin/env python3
 """
-This module handles routes all incoming requests to the appropriate modules.
+This module builds the server application and routes all incoming requests to
+the appropriate modules through aiohttp's route table.
 General responses, like the options header, are also defined here
 """
 
 # pylint: disable=broad-except
 
 # default modules
-import re
+import time
+from typing import Awaitable, Callable
 
 # installed modules
 import aiohttp
@@ -16,6 +18,26 @@ from aiohttp import web
 # custom modules
 import logger as Logger
 import jobs as Jobs
+import profiler as Profiler
+from metrics import REGISTRY, Histogram
+from request_timing import CURRENT_TIMER, RequestTimer, timed
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "http_request_duration_seconds",
+    "Seconds spent handling a request, by method and route",
+    ("method", "route")
+))
+HTTP_PHASE_SECONDS = REGISTRY.register(Histogram(
+    "http_request_phase_seconds",
+    "Seconds spent in each phase of handling a request, by route",
+    ("route", "phase")
+))
+
+# longest profile, in seconds, /admin/profile/ runs
+PROFILE_MAX_SECONDS = 60
+
+# request key of the request timer
+TIMER_KEY = "timer"
 
 
 async def get_server_options_header() -> web.Response:
@@ -38,31 +60,111 @@ async def get_server_options_header() -> web.Response:
         headers=options_header
     )
 
-JOB_START_REGEX = re.compile(r"^\/jobs(\/|\?|$)")
+async def not_found(request: web.Request) -> web.Response:
+    """
+    Handles requests to paths that no route matches
+    """
+    Logger.log_error(
+        f"User tried to access unused URL @ {request.path_qs}"
+    )
+    return web.json_response(
+        status=404,
+        data={"error": "Not Found"}
+    )
 
 
-async def route_request(request: web.Request) -> web.Response:
+async def get_metrics(_request: web.Request) -> web.Response:
     """
-    Route the request to the appropriate handler funcion
+    Return every metric in the Prometheus text format
     """
+    return web.Response(
+        status=200,
+        text=REGISTRY.render(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+
+def route_label(request: web.Request) -> str:
+    """
+    Return the route a request was matched to, with the path parameters as
+    placeholders so the number of labels stays bounded
+    """
+    resource = request.match_info.route.resource
+    if resource is None:
+        return "unmatched"
+    return resource.canonical.rstrip("/") or "/"
+
+
+async def profile_server(request: web.Request) -> web.Response:
+    """
+    Profile the server for the requested number of seconds and return the
+    report as text
+    """
+    profiler = request.query.get("profiler", "cprofile")
+    sort = request.query.get("sort", "cumulative")
     try:
-        request_path = request.path
+        seconds = float(request.query.get("seconds", "10"))
+        limit = int(request.query.get("limit", "50"))
+    except ValueError:
+        seconds = limit = -1
 
-        response = None
-        if request.method == 'OPTIONS':
-            response = await get_server_options_header()
-        elif JOB_START_REGEX.match(request_path):
-            response = await Jobs.router(request)
+    # also rejects nan
+    if (
+        not 0 < seconds <= PROFILE_MAX_SECONDS
+        or limit <= 0
+        or profiler not in ("cprofile", "sample")
+        or sort not in Profiler.CPROFILE_SORT_KEYS
+    ):
+        Logger.log_error(
+            f"User tried to profile with invalid parameters @ {request.path_qs}"
+        )
+        return web.json_response(
+            status=400,
+            data={
+                "error": "Invalid profile parameters",
+                "expected": {
+                    "seconds": f"0 < seconds <= {PROFILE_MAX_SECONDS}",
+                    "profiler": "cprofile or sample",
+                    "sort": ", ".join(Profiler.CPROFILE_SORT_KEYS),
+                    "limit": "limit > 0",
+                },
+            }
+        )
+
+    # released in the finally below, a with block would wait for the lock
+    # pylint: disable=consider-using-with
+    if not Profiler.PROFILE_LOCK.acquire(blocking=False):
+        return web.json_response(
+            status=409,
+            data={"error": "A profile is already running"}
+        )
+
+    try:
+        Logger.log_info(f"Profiling the server for {seconds} seconds")
+        if profiler == "cprofile":
+            report = await Profiler.profile_loop(seconds, sort, limit)
         else:
-            Logger.log_error(
-                f"User tried to access unused URL @ {request.path_qs}"
-            )
-            response = web.json_response(
-                status=404,
-                data={"error": "Not Found"}
-            )
+            report = await Profiler.sample_threads(seconds, limit)
+
+    finally:
+        Profiler.PROFILE_LOCK.release()
+
+    return web.Response(status=200, text=report, content_type="text/plain")
+
+
+async def route_request(
+    request: web.Request,
+    handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    """
+    Run the handler aiohttp matched to the request
+    """
+    try:
+        if request.method == 'OPTIONS':
+            return await get_server_options_header()
 
-        return response
+        return await handler(request)
 
     except Exception as exc:
         Logger.log_exception(
@@ -72,15 +174,21 @@ async def route_request(request: web.Request) -> web.Response:
         raise
 
 
-async def entry_point(request: web.Request) -> web.Response:
+@web.middleware
+async def entry_point(
+    request: web.Request,
+    handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
     """Entry point for all requests to the server"""
+    start_time = time.perf_counter()
     try:
-        Logger.log_info(
-            f"Received {request.method} request to {request.path_qs}"
-        )
+        with timed("logging"):
+            Logger.log_info(
+                f"Received {request.method} request to {request.path_qs}"
+            )
 
         try:
-            response = await route_request(request)
+            response = await route_request(request, handler)
 
         except aiohttp.ServerTimeoutError:
             Logger.log_error(
@@ -101,20 +209,14 @@ async def entry_point(request: web.Request) -> web.Response:
                 data={"error": "Exception in request handler"}
             )
 
-        if 200 <= response.status < 300:
-            Logger.log_info(
-                f"Success Code ({response.status})"
-                f" returned with text ({response.text})"
-                f" after ({request.method})"
-                f" request to ({request.path_qs})"
-            )
-        else:
-            Logger.log_error(
-                f"Error Code ({response.status})"
-                f" returned with text ({response.text})"
-                f" after ({request.method})"
-                f" request to ({request.path_qs})"
-            )
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start_time,
+            request.method,
+            route_label(request)
+        )
+
+        with timed("logging"):
+            log_response(request, response)
 
     except Exception as exc:
         Logger.log_exception(
@@ -127,3 +229,91 @@ async def entry_point(request: web.Request) -> web.Response:
         )
 
     return response
+
+
+def log_response(request: web.Request, response: web.StreamResponse) -> None:
+    """
+    Log the status of a response
+    """
+    # streamed responses have already been sent and have no text
+    response_text = getattr(response, "text", "<streamed>")
+    if 200 <= response.status < 300:
+        Logger.log_info(
+            f"Success Code ({response.status})"
+            f" returned with text ({response_text})"
+            f" after ({request.method})"
+            f" request to ({request.path_qs})"
+        )
+    else:
+        Logger.log_error(
+            f"Error Code ({response.status})"
+            f" returned with text ({response_text})"
+            f" after ({request.method})"
+            f" request to ({request.path_qs})"
+        )
+
+
+@web.middleware
+async def time_request(
+    request: web.Request,
+    handler: Callable[[web.Request], Awaitable]
+) -> web.StreamResponse:
+    """
+    Time the phases of the request and record them as metrics. The phases are
+    also sent in the Server-Timing header, see add_server_timing.
+    aiohttp finds the route before any middleware runs, so routing is not
+    timed here, see benchmarks/routing.py
+    """
+    timer = RequestTimer()
+    request[TIMER_KEY] = timer
+    token = CURRENT_TIMER.set(timer)
+    try:
+        return await handler(request)
+
+    finally:
+        CURRENT_TIMER.reset(token)
+        route = route_label(request)
+        for phase, seconds in timer.phases.items():
+            HTTP_PHASE_SECONDS.observe(seconds, route, phase)
+
+
+async def add_server_timing(
+    request: web.Request,
+    response: web.StreamResponse
+) -> None:
+    """
+    Send the phases timed so far in the Server-Timing header. Runs when the
+    response headers are sent, which for streamed responses is before the
+    body is written
+    """
+    timer = request.get(TIMER_KEY)
+    if timer is not None:
+        response.headers["Server-Timing"] = timer.server_timing()
+
+
+def create_admin_app() -> web.Application:
+    """
+    Build the application that serves /admin/. It needs the api_key header,
+    like /jobs/
+    """
+    app = web.Application(middlewares=[Jobs.check_api_key])
+    app.router.add_get("/profile", profile_server, allow_head=False)
+    app.router.add_get("/profile/", profile_server, allow_head=False)
+    app.router.add_route("*", "/{tail:.*}", not_found)
+    return app
+
+
+def create_app() -> web.Application:
+    """
+    Build the server application. Every request passes through entry_point,
+    the endpoints under /jobs/ are served by the jobs application
+    """
+    app = web.Application(middlewares=[time_request, entry_point])
+    app.add_subapp("/jobs", Jobs.create_app())
+    app.add_subapp("/admin", create_admin_app())
+    app.router.add_get("/metrics", get_metrics, allow_head=False)
+    # matches every other path, so aiohttp never builds a not found error
+    app.router.add_route("*", "/{tail:.*}", not_found)
+
+    app.on_response_prepare.append(add_server_timing)
+    return app
@@ -2,12 +2,19 @@
 """
 This module houses the runtime functionality.
 The content of this module can be replaced by any other implementation as long
-as the interface remains constant
+as the interface remains constant.
+
+Jobs are passed to the runtime as compiled jobs. str(job) is the canonical job
+string and iterating over a job yields its (axis, angle) rotations
 """
 
+import asyncio
 import time
 import threading
 
+from job_parser import CompiledJob
+from simulator import run_simulation
+
 # pylint: disable=no-self-use
 # pylint: disable=fixme
 # pylint: disable=consider-using-with
@@ -34,7 +41,7 @@ class Runtime:
         # TODO: remove
         self.is_startup = True
 
-    def execute(self, job: str) -> int:
+    def execute(self, job: CompiledJob) -> int:
         """
         Executes a job with the runtime
         Just return the output from echo for debugging
@@ -45,40 +52,99 @@ class Runtime:
         """
         return self.echo(job)
 
-    def simulate(self, job: str) -> int:
+    def simulate(self, job: CompiledJob) -> int:
         """
         Simulates a job on a simulation of the runtime interface
-        Just return the output from echo for debugging
+        The simulation does not use the runtime, so it always starts
+
+        Return:  0 on success
+                >0 if the job could not be simulated
+        """
+        return run_simulation([job])[0]
+
+    def echo(self, job: CompiledJob) -> int:
+        """
+        Return fake retun codes
+        Hard coded for debugging
 
         Return: -1 on failed to start
                  0 on success
                 >0 on runtime error
         """
-        return self.echo(job)
+        if not self.reserve():
+            return -1
+
+        time.sleep(1)
+        job_return_code = self.echo_return_code(job)
+
+        self.free()
 
-    def echo(self, job: str) -> int:
+        return job_return_code
+
+    async def execute_async(self, job: CompiledJob) -> int:
         """
-        Return fake retun codes
-        Hard coded for debugging
+        Awaitable version of execute. Does not block the event loop
 
         Return: -1 on failed to start
                  0 on success
                 >0 on runtime error
         """
-        self.lock.acquire()
-        start_is_available = self.is_available
-        self.lock.release()
+        return await self.echo_async(job)
+
+    async def simulate_async(self, job: CompiledJob) -> int:
+        """
+        Awaitable version of simulate. A single simulation takes microseconds,
+        so it is run inline
+
+        Return:  0 on success
+                >0 on runtime error
+        """
+        return self.simulate(job)
+
+    async def echo_async(self, job: CompiledJob) -> int:
+        """
+        Awaitable version of echo. Does not block the event loop
 
-        if not start_is_available:
+        Return: -1 on failed to start
+                 0 on success
+                >0 on runtime error
+        """
+        if not self.reserve():
             return -1
 
-        self.lock.acquire()
-        self.is_available = False
-        self.lock.release()
+        await asyncio.sleep(1)
+        job_return_code = self.echo_return_code(job)
 
-        job_return_code = 4
+        self.free()
 
-        time.sleep(1)
+        return job_return_code
+
+    def reserve(self) -> bool:
+        """
+        Thread safe way to mark this runtime as busy
+
+        Return: False if the runtime was not available
+        """
+        with self.lock:
+            if not self.is_available:
+                return False
+            self.is_available = False
+            return True
+
+    def free(self) -> None:
+        """
+        Thread safe way to mark this runtime as available again
+        """
+        with self.lock:
+            self.is_available = True
+
+    @staticmethod
+    def echo_return_code(job: CompiledJob) -> int:
+        """
+        Hard coded return codes used by echo for debugging
+        """
+        job = str(job)
+        job_return_code = 4
         if job == "X(0), Y(0), X(0)":
             job_return_code = 0
         if job == "X(90), Y(0), Z(90)":
@@ -87,11 +153,6 @@ class Runtime:
             job_return_code = 2
         if job == "Z(90), Y(180), X(0)":
             job_return_code = 3
-
-        self.lock.acquire()
-        self.is_available = True
-        self.lock.release()
-
         return job_return_code
 
     def get_is_available(self) -> bool:
@@ -0,0 +1,80 @@
+#! /usr/bin/env python3
+"""
+Adapts runtimes that only offer the blocking interface to the awaitable one.
+
+The blocking calls are run on a small thread pool so that they do not block the
+event loop. The pool is bounded, so the number of threads stays constant no
+matter how many jobs are in flight
+"""
+
+# default modules
+import asyncio
+import inspect
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Union
+
+# custom modules
+from job_parser import CompiledJob
+
+
+class BlockingRuntimeAdapter:
+    """
+    Exposes execute_async, simulate_async and echo_async for a runtime that
+    only implements execute, simulate and echo
+    """
+
+    def __init__(self, runtime, executor: Executor) -> None:
+        """
+        runtime: the blocking runtime to wrap
+        executor: executor the blocking calls are run on
+        """
+        self.runtime = runtime
+        self.runtime_id = runtime.runtime_id
+        self.executor = executor
+
+    async def execute_async(self, job: CompiledJob) -> int:
+        """
+        Run the blocking execute call on the executor
+        """
+        return await self.run_blocking(self.runtime.execute, job)
+
+    async def simulate_async(self, job: CompiledJob) -> int:
+        """
+        Run the blocking simulate call on the executor
+        """
+        return await self.run_blocking(self.runtime.simulate, job)
+
+    async def echo_async(self, job: CompiledJob) -> int:
+        """
+        Run the blocking echo call on the executor
+        """
+        return await self.run_blocking(self.runtime.echo, job)
+
+    def get_is_available(self) -> bool:
+        """
+        Availability checks are cheap, so they are passed straight through
+        """
+        return self.runtime.get_is_available()
+
+    async def run_blocking(self, function, job: CompiledJob) -> int:
+        """
+        Await a blocking runtime function on the executor
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, function, job)
+
+
+def as_async_runtime(runtime, executor: Union[None, Executor] = None):
+    """
+    Return the runtime unchanged if it already implements the awaitable
+    interface, otherwise wrap it in a BlockingRuntimeAdapter
+    """
+    if inspect.iscoroutinefunction(getattr(runtime, "execute_async", None)):
+        return runtime
+
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix=f"runtime-{runtime.runtime_id}"
+        )
+    return BlockingRuntimeAdapter(runtime, executor)
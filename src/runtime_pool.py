@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+"""
+Hands out free runtimes to the job driver.
+
+Jobs waiting for a runtime await a future that is completed as soon as a
+runtime is released, so a waiting job is started immediately and idle waiting
+costs no CPU.
+
+The pool is not thread safe, it must only be used from the dispatcher's event
+loop
+"""
+
+# default modules
+import asyncio
+import collections
+from typing import Iterable
+
+
+class RuntimePool:
+    """
+    This class tracks which runtimes are free and wakes waiting jobs
+    """
+
+    def __init__(self, runtimes: Iterable, retry_delay: float = 0.25) -> None:
+        """
+        runtimes: the runtimes managed by this pool
+        retry_delay: seconds to wait before handing out a runtime again after
+            it reported that it was not available
+        """
+        self.runtimes = list(runtimes)
+        self.retry_delay = retry_delay
+        self.free = collections.deque(self.runtimes)
+        self.waiters = collections.deque()
+
+    async def acquire(self):
+        """
+        Wait until a runtime is free and hand it out to the caller.
+        The caller owns the runtime until it is passed back to release
+        """
+        if self.free:
+            return self.free.popleft()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            return await waiter
+
+        except asyncio.CancelledError:
+            # a runtime may have been handed over just before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release(waiter.result())
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self, runtime, is_available: bool = True) -> None:
+        """
+        Return a runtime to the pool and wake the longest waiting job.
+        If the runtime reported that it is not available it is only handed out
+        again after retry_delay seconds
+        """
+        if not is_available:
+            asyncio.get_running_loop().call_later(
+                self.retry_delay,
+                self.release,
+                runtime
+            )
+            return
+
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(runtime)
+                return
+
+        self.free.append(runtime)
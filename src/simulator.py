@@ -0,0 +1,352 @@
+#! /usr/bin/env python3
+"""
+Simulates jobs with NumPy instead of running them on a hardware runtime.
+
+Every rotation of a job is turned into a 3x3 rotation matrix and the matrices
+are composed in order, the first rotation being applied first. Jobs are
+simulated in batches: at each step the next rotation of every job in the batch
+that is still running is built and applied in a single vectorised operation,
+so the Python overhead is paid per step rather than per rotation.
+
+Every job that is simulated returns 0. Only a batch that could not be
+simulated returns SIMULATION_ERROR for its jobs.
+
+The work is CPU bound, so batches can be run on a process pool. Jobs are sent
+to the worker processes packed into three byte strings per chunk, which keeps
+the pickling overhead independent of the number of rotations. If the pool
+breaks, e.g. because a worker process was killed, the chunks it lost are
+simulated on the loop instead and a new pool is started
+"""
+
+# pylint: disable=broad-except
+
+# default modules
+import asyncio
+import math
+from array import array
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Callable, List, Sequence, Tuple, Union
+
+# installed modules
+import numpy as np
+
+# custom modules
+import logger as Logger
+from job_parser import CompiledJob
+
+# return code of a job that could not be simulated
+SIMULATION_ERROR = 4
+
+# number of jobs simulated in one vectorised pass
+SIMULATION_BATCH_SIZE = 4096
+
+# smallest number of jobs sent to a worker process in one chunk
+SIMULATION_MIN_CHUNK_SIZE = 64
+
+
+def rotation_matrices(axes: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """
+    Build the rotation matrix of every (axis, angle) pair
+    axes: axis codes, 0 for X, 1 for Y and 2 for Z
+    angles: angles in degrees
+
+    Return: array of shape (len(axes), 3, 3)
+    """
+    count = len(axes)
+    theta = np.radians(angles.astype(np.float64))
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+
+    # the axis of rotation and the two coordinates it rotates, in the order
+    # that gives a right handed rotation
+    axis = axes.astype(np.intp)
+    first = (axis + 1) % 3
+    second = (axis + 2) % 3
+    rows = np.arange(count)
+
+    matrices = np.zeros((count, 3, 3))
+    matrices[rows, axis, axis] = 1.0
+    matrices[rows, first, first] = cos
+    matrices[rows, second, second] = cos
+    matrices[rows, first, second] = -sin
+    matrices[rows, second, first] = sin
+    return matrices
+
+
+def pack_jobs(jobs: Sequence[CompiledJob]) -> Tuple[bytes, bytes, bytes]:
+    """
+    Pack a batch of jobs into the number of rotations of every job and the
+    axes and angles of all rotations, one job after the other
+    """
+    lengths = array("I")
+    axes = array("B")
+    angles = array("H")
+    for job in jobs:
+        lengths.append(len(job))
+        axes.extend(job.axes)
+        angles.extend(job.angles)
+    return lengths.tobytes(), axes.tobytes(), angles.tobytes()
+
+
+def simulate_batch(jobs: Sequence[CompiledJob]) -> np.ndarray:
+    """
+    Compose the rotations of every job
+
+    Return: array of shape (len(jobs), 3, 3) holding the rotation of each job
+    """
+    return simulate_packed(*pack_jobs(jobs))
+
+
+def simulate_packed(lengths: bytes, axes: bytes, angles: bytes) -> np.ndarray:
+    """
+    Compose the rotations of a batch of jobs packed by pack_jobs
+
+    Return: array of shape (number of jobs, 3, 3) holding the rotation of each
+        job
+    """
+    lengths = np.frombuffer(lengths, dtype=np.uint32).astype(np.intp)
+    axes = np.frombuffer(axes, dtype=np.uint8)
+    angles = np.frombuffer(angles, dtype=np.uint16)
+
+    count = len(lengths)
+    result = np.tile(np.eye(3), (count, 1, 1))
+    if not count:
+        return result
+
+    # longest jobs first, so the jobs still running at any step are a prefix
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    order = np.argsort(-lengths, kind="stable")
+    lengths = lengths[order]
+    offsets = offsets[order]
+
+    composed = result.copy()
+    for step in range(lengths[0]):
+        running = np.searchsorted(-lengths, -step, side="left")
+        positions = offsets[:running] + step
+        composed[:running] = (
+            rotation_matrices(axes[positions], angles[positions])
+            @ composed[:running]
+        )
+
+    result[order] = composed
+    return result
+
+
+def run_simulation(jobs: Sequence[CompiledJob]) -> List[int]:
+    """
+    Simulate a batch of jobs
+
+    Return: the return code of every job, in order
+    """
+    return [0] * len(simulate_batch(jobs))
+
+
+def run_packed(lengths: bytes, axes: bytes, angles: bytes) -> List[int]:
+    """
+    Simulate a batch of jobs packed by pack_jobs. This is the function run by
+    the worker processes
+
+    Return: the return code of every job, in order
+    """
+    return [0] * len(simulate_packed(lengths, axes, angles))
+
+
+# the batcher keeps its callbacks as well as its executor and queued jobs
+# pylint: disable=too-many-instance-attributes
+class SimulationBatcher:
+    """
+    Collects the simulation jobs submitted on an event loop and simulates them
+    in one pass once the loop is done with the current callback.
+    Without an executor the pass runs on the loop itself, otherwise the jobs
+    are split into one chunk per worker process and simulated in parallel
+    """
+
+    def __init__(
+        self,
+        on_result: Callable[[object, int], None],
+        executor: Union[None, Executor] = None,
+        worker_count: int = 1,
+        batch_size: int = SIMULATION_BATCH_SIZE,
+        *,
+        on_start: Union[None, Callable[[object], None]] = None,
+        executor_factory: Union[None, Callable[[], Executor]] = None
+    ) -> None:
+        """
+        on_result: called on the loop with the item and return code of every
+            simulated job
+        executor: optional process pool the chunks are simulated on
+        worker_count: number of workers of the executor
+        batch_size: maximum number of jobs simulated in one pass
+        on_start: optionally called on the loop with the item of every job
+            when its batch is simulated or sent to the executor
+        executor_factory: optionally creates the executor that replaces a
+            broken one. Without it the jobs are simulated on the loop once the
+            executor broke
+        """
+        self.on_result = on_result
+        self.on_start = on_start
+        self.executor = executor
+        self.executor_factory = executor_factory
+        self.worker_count = worker_count
+        self.batch_size = batch_size
+        self.pending = []
+        self.running = set()
+
+    def add(self, item: object, job: CompiledJob) -> None:
+        """
+        Queue a job for the next pass. Must be called on the event loop
+        """
+        self.pending.append((item, job))
+        if len(self.pending) == 1:
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        """
+        Simulate every queued job, or send it to the executor, and report the
+        results
+        """
+        pending = self.pending
+        self.pending = []
+
+        if self.executor is None:
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                self.start(batch)
+                self.simulate(batch)
+            return
+
+        # enough chunks to keep every worker busy, but not so many that the
+        # per chunk overhead dominates
+        chunk_size = min(
+            self.batch_size,
+            max(
+                SIMULATION_MIN_CHUNK_SIZE,
+                math.ceil(len(pending) / self.worker_count)
+            )
+        )
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            self.start(chunk)
+
+            executor = self.executor
+            if executor is None:
+                self.simulate(chunk)
+                continue
+
+            try:
+                future = loop.run_in_executor(
+                    executor,
+                    run_packed,
+                    *pack_jobs([job for _, job in chunk])
+                )
+
+            except Exception as exc:
+                # raised straight away by a broken or shut down pool
+                self.executor_failed(executor, exc)
+                self.simulate(chunk)
+                continue
+
+            self.running.add(future)
+            future.add_done_callback(
+                lambda done, chunk=chunk, executor=executor: self.chunk_done(
+                    chunk,
+                    executor,
+                    done
+                )
+            )
+
+    def simulate(self, batch: list) -> None:
+        """
+        Simulate a batch on the loop and report the results
+        """
+        try:
+            results = run_simulation([job for _, job in batch])
+
+        except Exception as exc:
+            Logger.log_exception("Exception caught simulating jobs", exc)
+            results = [SIMULATION_ERROR] * len(batch)
+
+        self.report(batch, results)
+
+    def executor_failed(self, executor: Executor, exc: BaseException) -> None:
+        """
+        Log a chunk that the executor could not simulate, and replace the
+        executor if it is broken
+        """
+        Logger.log_exception(
+            "Exception caught simulating jobs on the executor",
+            exc
+        )
+        if executor is not self.executor or not isinstance(exc, BrokenExecutor):
+            return
+
+        executor.shutdown(wait=False)
+        self.executor = None
+        if self.executor_factory is not None:
+            try:
+                self.executor = self.executor_factory()
+
+            except Exception as factory_exc:
+                Logger.log_exception(
+                    "Exception caught replacing the simulation executor",
+                    factory_exc
+                )
+
+    def start(self, batch: list) -> None:
+        """
+        Hand every job in a batch that is about to be simulated to on_start
+        """
+        if self.on_start is not None:
+            for item, _ in batch:
+                self.on_start(item)
+
+    def chunk_done(
+        self,
+        chunk: list,
+        executor: Executor,
+        future: asyncio.Future
+    ) -> None:
+        """
+        Report the results of a chunk simulated on the executor. A chunk the
+        executor failed on is simulated on the loop instead, so every job
+        gets a result
+        """
+        self.running.discard(future)
+        try:
+            results = future.result()
+
+        except (Exception, asyncio.CancelledError) as exc:
+            self.executor_failed(executor, exc)
+            self.simulate(chunk)
+            return
+
+        self.report(chunk, results)
+
+    def report(self, batch: list, results: List[int]) -> None:
+        """
+        Hand the result of every job in a batch to on_result
+        """
+        for (item, _), result in zip(batch, results):
+            self.on_result(item, result)
+
+    async def drain(self) -> None:
+        """
+        Wait until every queued job has been simulated and reported
+        """
+        while self.pending or self.running:
+            if self.running:
+                await asyncio.wait(set(self.running))
+            else:
+                await asyncio.sleep(0)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes. Call drain first to keep queued jobs. Jobs
+        added later are simulated on the loop
+        """
+        executor = self.executor
+        self.executor = None
+        self.executor_factory = None
+        if executor is not None:
+            executor.shutdown()
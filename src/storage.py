@@ -13,35 +13,168 @@ TODO: Replace SQLite with a more performant database
 
 # default modules
 import datetime
+import pathlib
+import queue
 import sqlite3
+import threading
 from sqlite3 import Error
-from typing import Union
+from typing import Callable, Iterator, Union
 
 # custom modules
 import logger as Logger
+from batch_queue import get_batch
+from job_record_cache import JobRecord, JobRecordCache
+from migrations import apply_migrations
 
 
+# this is only a record of the write and its result
+# pylint: disable=too-few-public-methods
+class PendingWrite:
+    """
+    A write waiting to be run and committed by the group commit writer
+    """
+
+    __slots__ = ("function", "on_commit", "result", "is_done")
+
+    def __init__(
+        self,
+        function: Callable[[sqlite3.Cursor], int],
+        on_commit: Union[None, Callable[[int], None]] = None
+    ) -> None:
+        self.function = function
+        self.on_commit = on_commit
+        self.result = 0
+        self.is_done = threading.Event()
+
+
+# the statement text only differs in the time field that is set
+SQL_UPDATE_JOB = (
+    " UPDATE"
+    "    jobs"
+    " SET"
+    "    status = ?,"
+    "    runtime = ?,"
+    "    return_code = ?,"
+    "    runtime_error = ?,"
+    "    {time_field} = ?"
+    " WHERE"
+    "    id = ?"
+)
+SQL_UPDATE_JOB_START = SQL_UPDATE_JOB.format(time_field="start_time")
+SQL_UPDATE_JOB_END = SQL_UPDATE_JOB.format(time_field="end_time")
+
+# number of recently written jobs kept in memory for get_job
+JOB_RECORD_CACHE_SIZE = 10000
+
+# number of prepared statements each connection keeps for reuse
+CACHED_STATEMENTS = 256
+
+# pragmas applied to every connection, see https://www.sqlite.org/pragma.html
+# synchronous NORMAL is durable across application crashes in WAL mode, only an
+# OS crash or power loss can roll back the last commits
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
+
+# the connection settings are kept on the instance, and the storage interface
+# is one method per query
+# pylint: disable=too-many-instance-attributes,too-many-public-methods
 class Storage:
     """
     This class manages the connection with the database system
+
+    The database is opened in WAL mode. All writes go through one writer
+    connection and every thread that reads gets its own read-only connection,
+    so reads never wait for writes.
+
+    In group commit mode all writes are handed to a single writer thread, which
+    runs every write queued within commit_interval seconds, up to commit_batch
+    writes, in one transaction with one commit.
+
+    Every job that is added or updated is written through to an in-memory
+    record cache once committed, and get_job reads from it first
     """
 
-    def __init__(self, filename: str = "jobs.db") -> None:
+    def __init__(
+        self,
+        filename: str = "jobs.db",
+        group_commit: bool = False,
+        commit_interval: float = 0.005,
+        commit_batch: int = 256,
+        pragmas: Union[None, dict] = None,
+        *,
+        record_cache_size: int = JOB_RECORD_CACHE_SIZE
+    ) -> None:
         """
         Initialse database config
+
+        pragmas: overrides for DEFAULT_PRAGMAS, e.g. synchronous, cache_size
+            and mmap_size
+        record_cache_size: number of job records kept in memory, 0 disables
+            the record cache
         """
         self.db_file = filename
         self.connection = None
+        self.group_commit = group_commit
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.write_queue = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        # held by anything that uses the writer connection: the writer thread,
+        # direct writes and migrations
+        self.write_lock = threading.Lock()
+        self.readers = threading.local()
+        self.reader_connections = []
+        self.update_listeners = []
+        self.records = JobRecordCache(record_cache_size)
+
+    def add_update_listener(self, listener: Callable[[dict], None]) -> None:
+        """
+        Call listener with every job update once it is committed. The update
+        holds the id of the job and the fields that were set. Listeners are
+        called on the thread that committed the update, so they must be quick
+        and must not block
+        """
+        self.update_listeners.append(listener)
+
+    def notify_update(self, job_update: dict) -> None:
+        """
+        Hand a committed job update to every update listener
+        """
+        for listener in self.update_listeners:
+            try:
+                listener(job_update)
+
+            except Exception as exe:
+                Logger.log_exception("Job update listener exception", exe)
 
     def connect_to_db(self):
         """
-        Create a connection to the database
+        Create the writer connection to the database and switch the database
+        to WAL journaling. Safe to call from several threads, only the first
+        call connects
         """
         try:
-            self.connection = sqlite3.connect(
-                self.db_file,
-                check_same_thread=False
-            )
+            with self.write_lock:
+                if self.connection:
+                    return
+
+                connection = sqlite3.connect(
+                    self.db_file,
+                    check_same_thread=False,
+                    cached_statements=CACHED_STATEMENTS
+                )
+                # the busy timeout is set first, switching to WAL needs a
+                # lock on the database that another connection may be holding
+                self.apply_pragmas(connection)
+                connection.execute("PRAGMA journal_mode = WAL")
+                self.connection = connection
 
         except Error as err:
             Logger.log_exception("DB error connecting to DB", err)
@@ -49,62 +182,125 @@ class Storage:
         except Exception as exe:
             Logger.log_exception("Connect to DB exception", exe)
 
-    def create_job_table(self) -> bool:
-        """
-        Create the job table if it doesn't exist yet
-        """
-        sql_create_table = (
-            "CREATE TABLE IF NOT EXISTS jobs ("
-            "   id INTEGER PRIMARY KEY,"
-            "   job TEXT NOT NULL,"
-            "   mode TEXT,"
-            "   status TEXT,"
-            "   runtime INTEGER,"
-            "   return_code INTEGER,"
-            "   runtime_error TEXT,"
-            "   created_time TEXT,"
-            "   start_time TEXT,"
-            "   end_time TEXT"
-            "); "
+    def connect_reader(self) -> sqlite3.Connection:
+        """
+        Create a read-only connection to the database
+        """
+        if not self.connection:
+            self.connect_to_db()
+
+        connection = sqlite3.connect(
+            f"{pathlib.Path(self.db_file).absolute().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS
         )
+        self.apply_pragmas(connection)
+        return connection
+
+    def get_reader(self) -> sqlite3.Connection:
+        """
+        Return the read-only connection of the calling thread, creating it on
+        first use
+        """
+        connection = getattr(self.readers, "connection", None)
+        if connection is None:
+            connection = self.connect_reader()
+            self.readers.connection = connection
+            with self.writer_lock:
+                self.reader_connections.append(connection)
+        return connection
+
+    def apply_pragmas(self, connection: sqlite3.Connection) -> None:
+        """
+        Apply the configured pragmas to a connection
+        """
+        for name, value in self.pragmas.items():
+            connection.execute(f"PRAGMA {name} = {value}")
+
+    def migrate(self) -> int:
+        """
+        Bring the database schema up to date. Call this once at startup,
+        before the first job is added
+
+        Return: the schema version, 0 on error
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(sql_create_table)
-            return True
+            if not self.connection:
+                self.connect_to_db()
+
+            with self.write_lock:
+                version = apply_migrations(self.connection)
+            Logger.log_info(f"DB schema at version {version}")
+            return version
 
         except Error as err:
-            Logger.log_exception("DB error creating the job table", err)
+            Logger.log_exception("DB error migrating the DB schema", err)
 
         except Exception as exe:
-            Logger.log_exception("Create job table in DB exception", exe)
+            Logger.log_exception("Migrate DB schema exception", exe)
 
-        # return False on error
-        return False
+        # return 0 on error
+        return 0
 
-    def add_job(self, job: str, mode: str) -> int:
+    def add_job(
+        self,
+        job: str,
+        mode: str,
+        *,
+        optimized_job: Union[None, str] = None,
+        priority: str = "normal",
+        estimated_cost: Union[None, float] = None
+    ) -> int:
         """
         Add a new job to the job table
+        optimized_job: the job that is run instead of job, if it was optimized
+        priority: priority class the job is scheduled in
+        estimated_cost: expected runtime of the job in seconds
         """
         try:
             created_time = datetime.datetime.utcnow().isoformat()
             if not self.connection:
                 self.connect_to_db()
-            self.create_job_table()
 
             sql_insert = (
                 " INSERT INTO"
-                "    jobs (job, mode, status, created_time)"
+                "    jobs (job, mode, optimized_job, priority, estimated_cost,"
+                "          status, created_time)"
                 " VALUES"
-                "    (?,?,?,?)"
+                "    (?,?,?,?,?,?,?)"
             )
 
-            cursor = self.connection.cursor()
-            cursor.execute(
-                sql_insert,
-                [job, mode, "Scheduled", created_time]
-            )
-            self.connection.commit()
-            return cursor.lastrowid
+            def insert(cursor: sqlite3.Cursor) -> int:
+                cursor.execute(
+                    sql_insert,
+                    [
+                        job,
+                        mode,
+                        optimized_job,
+                        priority,
+                        estimated_cost,
+                        "Scheduled",
+                        created_time
+                    ]
+                )
+                return cursor.lastrowid
+
+            def cache(job_id: int) -> None:
+                self.records.put(JobRecord(
+                    id=job_id,
+                    job=job,
+                    mode=mode,
+                    status="Scheduled",
+                    created_time=created_time,
+                    cached=False,
+                    optimized_job=optimized_job,
+                    priority=priority,
+                    estimated_cost=estimated_cost
+                ))
+
+            # the id is needed by the caller, so always wait for this write
+            return self.write(insert, on_commit=cache)
 
         except Error as err:
             Logger.log_exception("DB error when creating job", err)
@@ -115,6 +311,180 @@ class Storage:
         # return 0 on error
         return 0
 
+    def add_cached_job(
+        self,
+        job: str,
+        mode: str,
+        return_code: int,
+        runtime_error: Union[None, str] = None,
+        *,
+        optimized_job: Union[None, str] = None,
+        priority: str = "normal"
+    ) -> int:
+        """
+        Add a job that was completed from the result cache to the job table
+        optimized_job: the job the cached result belongs to, if it was optimized
+        priority: priority class the job was submitted in
+        """
+        job_ids = self.add_jobs(
+            [],
+            [(job, mode, return_code, runtime_error, optimized_job, priority)]
+        )
+
+        # return 0 on error
+        return job_ids[0] if job_ids else 0
+
+    def add_jobs(self, jobs: list, cached_jobs: list = ()) -> list:
+        """
+        Add a batch of jobs to the job table in one transaction, one insert
+        per job inside a savepoint, so either every job is added or none is.
+        Each job is a tuple of the job, mode, and optionally the optimized_job,
+        priority and estimated_cost arguments of add_job.
+        cached_jobs are jobs that were completed from the result cache, each
+        a tuple of the job, mode, return_code, runtime_error, optimized_job
+        and priority arguments of add_cached_job
+
+        Return: the ids of the new jobs, in order, followed by the ids of the
+            cached jobs, in order. An empty list on error
+        """
+        try:
+            created_time = datetime.datetime.utcnow().isoformat()
+            if not self.connection:
+                self.connect_to_db()
+
+            sql_insert = (
+                " INSERT INTO"
+                "    jobs (job, mode, optimized_job, priority, estimated_cost,"
+                "          status, created_time)"
+                " VALUES"
+                "    (?,?,?,?,?,?,?)"
+            )
+            sql_insert_cached = (
+                " INSERT INTO"
+                "    jobs (job, mode, optimized_job, priority, status,"
+                "          return_code, runtime_error, created_time,"
+                "          start_time, end_time, cached)"
+                " VALUES"
+                "    (?,?,?,?,?,?,?,?,?,?,1)"
+            )
+
+            def job_row(
+                job: str,
+                mode: str,
+                optimized_job: Union[None, str] = None,
+                priority: str = "normal",
+                estimated_cost: Union[None, float] = None
+            ) -> list:
+                return [
+                    job,
+                    mode,
+                    optimized_job,
+                    priority,
+                    estimated_cost,
+                    "Scheduled",
+                    created_time
+                ]
+
+            def cached_row(entry: tuple) -> list:
+                (
+                    job,
+                    mode,
+                    return_code,
+                    runtime_error,
+                    optimized_job,
+                    priority
+                ) = entry
+                return [
+                    job,
+                    mode,
+                    optimized_job,
+                    priority,
+                    "Success" if return_code == 0 else "Runtime Error",
+                    return_code,
+                    runtime_error,
+                    created_time,
+                    created_time,
+                    created_time,
+                ]
+
+            rows = [job_row(*entry) for entry in jobs]
+            cached_rows = [cached_row(entry) for entry in cached_jobs]
+
+            def insert_many(cursor: sqlite3.Cursor) -> list:
+                # each row reports its own id, so nothing is assumed about
+                # how the ids are allocated
+                job_ids = []
+
+                # all or nothing, even when sharing a group commit
+                cursor.execute("SAVEPOINT add_jobs")
+                try:
+                    for row in rows:
+                        cursor.execute(sql_insert, row)
+                        job_ids.append(cursor.lastrowid)
+                    for row in cached_rows:
+                        cursor.execute(sql_insert_cached, row)
+                        job_ids.append(cursor.lastrowid)
+                except Error:
+                    cursor.execute("ROLLBACK TO add_jobs")
+                    raise
+                finally:
+                    cursor.execute("RELEASE add_jobs")
+                return job_ids
+
+            def cache(job_ids: list) -> None:
+                for job_id, row in zip(job_ids, rows):
+                    self.records.put(JobRecord(
+                        id=job_id,
+                        job=row[0],
+                        mode=row[1],
+                        optimized_job=row[2],
+                        priority=row[3],
+                        estimated_cost=row[4],
+                        status=row[5],
+                        created_time=row[6],
+                        cached=False
+                    ))
+
+                for job_id, row in zip(job_ids[len(rows):], cached_rows):
+                    self.records.put(JobRecord(
+                        id=job_id,
+                        job=row[0],
+                        mode=row[1],
+                        optimized_job=row[2],
+                        priority=row[3],
+                        status=row[4],
+                        return_code=row[5],
+                        runtime_error=row[6],
+                        created_time=row[7],
+                        start_time=row[8],
+                        end_time=row[9],
+                        cached=True
+                    ))
+
+                    # the job is finished as soon as it is added
+                    self.notify_update({
+                        "id": job_id,
+                        "mode": row[1],
+                        "status": row[4],
+                        "runtime": None,
+                        "return_code": row[5],
+                        "runtime_error": row[6],
+                        "time": row[9],
+                    })
+
+            job_ids = self.write(insert_many, on_commit=cache)
+            if job_ids:
+                return job_ids
+
+        except Error as err:
+            Logger.log_exception("DB error when creating jobs", err)
+
+        except Exception as exe:
+            Logger.log_exception("Create job entries in DB exception", exe)
+
+        # return an empty list on error
+        return []
+
     # disable this warning because this method will be an exception to the rule
     # if any other arguments need to be added we'll need to refactor to use
     # fewer arguments
@@ -125,10 +495,16 @@ class Storage:
         status: str,
         runtime: Union[None, int] = None,
         return_code: Union[None, int] = None,
-        runtime_error: Union[None, str] = None
+        runtime_error: Union[None, str] = None,
+        *,
+        mode: Union[None, str] = None
     ) -> int:
         """
-        Update a job from the job table
+        Update a job from the job table. mode is not stored, it is only passed
+        on to the update listeners
+
+        Return: db_id once the update is committed or, in group commit mode,
+            queued. 0 on error
         """
         try:
             timestamp = timestamp = datetime.datetime.utcnow().isoformat()
@@ -136,27 +512,47 @@ class Storage:
             if not self.connection:
                 self.connect_to_db()
 
-            time_field = 'start_time' if return_code is None else 'end_time'
-            sql_update = (
-                " UPDATE"
-                "    jobs"
-                " SET"
-                "    status = ?,"
-                "    runtime = ?,"
-                "    return_code = ?,"
-                "    runtime_error = ?,"
-                f"   {time_field} = ?"
-                " WHERE"
-                "    id = ?"
-            )
+            # fixed statement text, so the prepared statement is reused
+            if return_code is None:
+                sql_update = SQL_UPDATE_JOB_START
+                time_field = "start_time"
+            else:
+                sql_update = SQL_UPDATE_JOB_END
+                time_field = "end_time"
+
+            def update(cursor: sqlite3.Cursor) -> int:
+                cursor.execute(
+                    sql_update,
+                    [status, runtime, return_code, runtime_error, timestamp, db_id]
+                )
+                return db_id
+
+            def notify(_: int) -> None:
+                # the cache is updated first, so listeners that read the job
+                # see the update
+                self.records.update(
+                    int(db_id),
+                    status=status,
+                    runtime=runtime,
+                    return_code=return_code,
+                    runtime_error=runtime_error,
+                    **{time_field: timestamp}
+                )
+
+                self.notify_update({
+                    "id": int(db_id),
+                    "mode": mode,
+                    "status": status,
+                    "runtime": runtime,
+                    "return_code": return_code,
+                    "runtime_error": runtime_error,
+                    "time": timestamp,
+                })
 
-            cursor = self.connection.cursor()
-            cursor.execute(
-                sql_update,
-                [status, runtime, return_code, runtime_error, timestamp, db_id]
-            )
-            self.connection.commit()
-            return cursor.lastrowid
+            # in group commit mode this returns once the update is queued, use
+            # flush to wait for it to be committed
+            self.write(update, wait=False, on_commit=notify)
+            return db_id
 
         except Error as err:
             Logger.log_exception(f"DB error when updating job {db_id}", err)
@@ -170,14 +566,181 @@ class Storage:
         # return 0 on error
         return 0
 
-    def get_job(self, db_id: int) -> dict:
+    def write(
+        self,
+        function: Callable[[sqlite3.Cursor], int],
+        wait: bool = True,
+        on_commit: Union[None, Callable[[int], None]] = None
+    ) -> int:
         """
-        Retrieve a job from the job table
+        Run function with a cursor as a write and commit it.
+        In group commit mode the write is handed to the writer thread and this
+        only waits for the commit if wait is set.
+        on_commit is called with the result once the write is committed, if it
+        succeeded. In group commit mode it runs on the writer thread, before
+        the next batch of writes
+
+        Return: the return value of function, 0 on error or if not waiting
+        """
+        if not self.group_commit:
+            with self.write_lock:
+                cursor = self.connection.cursor()
+                result = function(cursor)
+                self.connection.commit()
+            if on_commit and result:
+                self.run_on_commit(on_commit, result)
+            return result
+
+        if not self.writer:
+            self.start_writer()
+
+        pending = PendingWrite(function, on_commit)
+        self.write_queue.put(pending)
+        if not wait:
+            return 0
+
+        pending.is_done.wait()
+        return pending.result
+
+    def flush(self) -> None:
+        """
+        Wait until every write queued before this call is committed
+        """
+        if self.group_commit and self.writer:
+            self.write(lambda cursor: 0)
+
+    def close(self) -> None:
         """
+        Commit every queued write and stop the writer thread
+        """
+        with self.writer_lock:
+            writer = self.writer
+            self.writer = None
+
+        if writer:
+            self.write_queue.put(None)
+            writer.join()
+
+        with self.writer_lock:
+            reader_connections = self.reader_connections
+            self.reader_connections = []
+            self.readers = threading.local()
+
+        for connection in reader_connections:
+            connection.close()
+
+    def start_writer(self) -> None:
+        """
+        Start the group commit writer thread if it is not running yet
+        """
+        with self.writer_lock:
+            if self.writer:
+                return
+
+            if not self.connection:
+                self.connect_to_db()
+
+            self.writer = threading.Thread(
+                target=self.writer_loop,
+                name="storage-writer",
+                daemon=True
+            )
+            self.writer.start()
+
+    def writer_loop(self) -> None:
+        """
+        Body of the writer thread. Collects queued writes until the batch is
+        full or the commit interval has passed, then commits them together
+        """
+        is_running = True
+        while is_running:
+            batch, is_stopped = get_batch(
+                self.write_queue,
+                self.commit_batch,
+                self.commit_interval
+            )
+            is_running = not is_stopped
+
+            self.commit_writes(batch)
+
+    def commit_writes(self, batch: list) -> None:
+        """
+        Run every write in the batch in one transaction and wake the callers.
+        Nothing raised here may escape, the writer thread would die with it and
+        strand every caller waiting for a commit. If the batch can not be
+        committed, every write in it fails with a result of 0
+        """
+        is_committed = False
         try:
             if not self.connection:
                 self.connect_to_db()
 
+            # migrations run on the writer connection as well
+            with self.write_lock:
+                cursor = self.connection.cursor()
+                for pending in batch:
+                    # a failed statement has no effect, so the others can commit
+                    try:
+                        pending.result = pending.function(cursor)
+
+                    except Exception as exe:
+                        Logger.log_exception("Group commit write exception", exe)
+
+                self.connection.commit()
+                is_committed = True
+
+        except Error as err:
+            Logger.log_exception("DB error on group commit", err)
+
+        except Exception as exe:
+            Logger.log_exception("Group commit exception", exe)
+
+        finally:
+            if not is_committed:
+                self.rollback()
+            for pending in batch:
+                if not is_committed:
+                    pending.result = 0
+                pending.is_done.set()
+
+        for pending in batch:
+            if pending.on_commit and pending.result:
+                self.run_on_commit(pending.on_commit, pending.result)
+
+    def rollback(self) -> None:
+        """
+        Roll back the open transaction of the writer connection, if any
+        """
+        try:
+            with self.write_lock:
+                if self.connection:
+                    self.connection.rollback()
+
+        except Exception as exe:
+            Logger.log_exception("DB rollback exception", exe)
+
+    @staticmethod
+    def run_on_commit(on_commit: Callable[[int], None], result: int) -> None:
+        """
+        Call the on_commit callback of a committed write. The write stands
+        whatever the callback does, so its errors are only logged
+        """
+        try:
+            on_commit(result)
+
+        except Exception as exe:
+            Logger.log_exception("Write on_commit callback exception", exe)
+
+    def get_job(self, db_id: int) -> dict:
+        """
+        Retrieve a job from the record cache, or the job table if it is not
+        cached
+        """
+        try:
+            job = self.records.get(int(db_id))
+            if job is not None:
+                return job
+
             sql_select = (
                 " SELECT"
                 "    *"
@@ -187,22 +750,12 @@ class Storage:
                 "    id = ?"
             )
 
-            cursor = self.connection.cursor()
+            cursor = self.get_reader().cursor()
             cursor.execute(sql_select, [db_id])
-            self.connection.commit()
             row = cursor.fetchone()
-            return {
-                "id": row[0],
-                "job": row[1],
-                "mode": row[2],
-                "status": row[3],
-                "runtime": row[4],
-                "return_code": row[5],
-                "runtime_error": row[6],
-                "created_time": row[7],
-                "start_time": row[8],
-                "end_time": row[9],
-            }
+            # an unfinished statement would keep the reader on an old snapshot
+            cursor.close()
+            return self.row_to_job(row)
 
         except Error as err:
             Logger.log_exception(
@@ -219,40 +772,30 @@ class Storage:
         # return 0 on error
         return 0
 
-    def list_jobs(self) -> list:
+    def list_jobs(self, after_id: int = 0, limit: int = 100) -> list:
         """
-        Retrieve a list of all jobs in the DB
+        Retrieve a page of jobs from the DB, ordered by id.
+        Uses the id of the last job of the previous page as the cursor, so the
+        cost of a page does not grow with the size of the table
+
+        after_id: only jobs with an id greater than this are returned
+        limit: maximum number of jobs to return
         """
         try:
-            if not self.connection:
-                self.connect_to_db()
-
             sql_select = (
                 " SELECT"
                 "    *"
                 " FROM"
                 "    jobs"
+                " WHERE"
+                "    id > ?"
                 " ORDER BY id ASC"
+                " LIMIT ?"
             )
 
-            cursor = self.connection.cursor()
-            cursor.execute(sql_select)
-            self.connection.commit()
-            return_list = []
-            for row in cursor.fetchall():
-                return_list.append({
-                    "id": row[0],
-                    "job": row[1],
-                    "mode": row[2],
-                    "status": row[3],
-                    "runtime": row[4],
-                    "return_code": row[5],
-                    "runtime_error": row[6],
-                    "created_time": row[7],
-                    "start_time": row[8],
-                    "end_time": row[9],
-                })
-            return return_list
+            cursor = self.get_reader().cursor()
+            cursor.execute(sql_select, [after_id, limit])
+            return [self.row_to_job(row) for row in cursor.fetchall()]
 
         except Error as err:
             Logger.log_exception(
@@ -269,5 +812,70 @@ class Storage:
         # return 0 on error
         return 0
 
+    def iter_jobs(self, chunk_size: int = 1000) -> Iterator[list]:
+        """
+        Iterate over every job in the DB, ordered by id.
+        Rows are fetched from a single cursor chunk_size at a time, so only one
+        chunk is held in memory no matter how large the table is.
+        The chunks may be fetched from different threads, so the export gets a
+        read-only connection of its own
+        """
+        connection = None
+        try:
+            sql_select = (
+                " SELECT"
+                "    *"
+                " FROM"
+                "    jobs"
+                " ORDER BY id ASC"
+            )
+
+            connection = self.connect_reader()
+            cursor = connection.cursor()
+            cursor.execute(sql_select)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield [self.row_to_job(row) for row in rows]
 
-STORAGE_INSTANCE = Storage()
+        except Error as err:
+            Logger.log_exception(
+                "DB error when exporting all jobs",
+                err
+            )
+
+        except Exception as exe:
+            Logger.log_exception(
+                "Export all jobs in DB exception",
+                exe
+            )
+
+        finally:
+            if connection:
+                connection.close()
+
+    @staticmethod
+    def row_to_job(row: tuple) -> dict:
+        """
+        Convert a row from the job table to the dict returned by the API
+        """
+        return {
+            "id": row[0],
+            "job": row[1],
+            "mode": row[2],
+            "status": row[3],
+            "runtime": row[4],
+            "return_code": row[5],
+            "runtime_error": row[6],
+            "created_time": row[7],
+            "start_time": row[8],
+            "end_time": row[9],
+            "cached": bool(row[10]),
+            "optimized_job": row[11],
+            "priority": row[12],
+            "estimated_cost": row[13],
+        }
+
+
+STORAGE_INSTANCE = Storage(group_commit=True)
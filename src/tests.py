@@ -4,14 +4,54 @@
 This module includes all unit tests
 """
 
-# installed modules
+# all tests are kept in this one module
+# pylint: disable=too-many-lines
+
+# default modules
 import asyncio
-from aiohttp import web
-from aiohttp.test_utils import AioHTTPTestCase
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+
+# installed modules
+import numpy
+from aiohttp.test_utils import AioHTTPTestCase, make_mocked_request
 
 # custom modules
+import jobs as Jobs
+import logger as Logger
+import migrations
 import router as Router
+from cost_model import CostModel
+from dispatcher import Dispatcher
+from fair_queue import FairQueue
+from job_events import JobEvents, JobStream, Subscriber
+from job_optimizer import optimize_job
+from job_parser import CompiledJob, parse_job, parse_job_memo
+from metrics import Counter, Histogram
+from result_cache import ResultCache
 from runtime import Runtime
+from runtime_adapter import BlockingRuntimeAdapter, as_async_runtime
+from runtime_pool import RuntimePool
+from simulator import (
+    SIMULATION_ERROR,
+    SimulationBatcher,
+    run_simulation,
+    simulate_batch
+)
+from storage import STORAGE_INSTANCE, Storage
 
 
 # pylint: disable=fixme
@@ -32,6 +72,8 @@ TEST_MODES = [
 ]
 
 
+# one test per request scenario, see the class docstring
+# pylint: disable=too-many-public-methods
 class RestRequestTestCase(AioHTTPTestCase):
     """
     This test case handles all REST requests.
@@ -43,9 +85,8 @@ class RestRequestTestCase(AioHTTPTestCase):
         """
         Override the base class function to set up our server app
         """
-        app = web.Application()
-        app.add_routes([web.route('*', r'/{tail:.*}', Router.entry_point)])
-        return app
+        STORAGE_INSTANCE.migrate()
+        return Router.create_app()
 
     async def test_options(self):
         """
@@ -214,6 +255,96 @@ class RestRequestTestCase(AioHTTPTestCase):
             text = await resp.text()
             self.assertIn("Request body malformed", text)
 
+    async def test_jobs_submit_batch(self):
+        """
+        Test requests to /jobs/add/batch/ with valid and partly valid batches.
+        Named to run after the tests that count the jobs added before them
+        """
+        batches = [
+            [
+                {"job": "X(10)", "mode": "echo"},
+                {"job": "Y(20)", "mode": "echo"},
+                {"job": "Z(30)", "mode": "echo"},
+            ],
+            [
+                {"job": "X(11)", "mode": "echo"},
+                {"job": "X(0", "mode": "echo"},
+                "X(0)",
+                {"job": "Y(21)", "mode": "echo"},
+            ],
+        ]
+        for batch in batches:
+            async with self.client.post(
+                "/jobs/add/batch/",
+                headers=TEST_HEADERS,
+                json=batch
+            ) as resp:
+                self.assertEqual(resp.status, 201)
+                data = await resp.json()
+
+            stored = [item for item in data["items"] if "id" in item]
+            self.assertEqual(data["count"], len(stored))
+            job_ids = [item["id"] for item in stored]
+            self.assertEqual(job_ids, sorted(job_ids))
+
+            for entry, item in zip(batch, data["items"]):
+                if "id" not in item:
+                    continue
+                async with self.client.get(
+                    f"/jobs/{item['id']}/",
+                    headers=TEST_HEADERS
+                ) as resp:
+                    self.assertEqual((await resp.json())["job"], entry["job"])
+
+        self.assertEqual(data["count"], 2)
+        self.assertEqual(
+            [item.get("error") for item in data["items"]],
+            [
+                None,
+                "Job string not in the valid format",
+                "Batch entry malformed",
+                None,
+            ]
+        )
+
+    async def test_jobs_add_batch_invalid(self):
+        """
+        Test requests to /jobs/add/batch/ with invalid bodies and entries
+        """
+        for body in [{"job": "X(0)", "mode": "echo"}, [], "X(0)"]:
+            async with self.client.post(
+                "/jobs/add/batch/",
+                headers=TEST_HEADERS,
+                json=body
+            ) as resp:
+                self.assertEqual(resp.status, 400)
+                data = await resp.json()
+                self.assertEqual(
+                    data["error"],
+                    "Batch must be a non-empty list of jobs"
+                )
+
+        async with self.client.post(
+            "/jobs/add/batch/",
+            headers=TEST_HEADERS,
+            json=[
+                {"job": "X(0", "mode": "echo"},
+                {"job": "X(0)", "mode": "simulate"},
+                "X(0)",
+            ]
+        ) as resp:
+            self.assertEqual(resp.status, 400)
+            data = await resp.json()
+            self.assertEqual(data["count"], 0)
+            self.assertEqual(
+                [item["error"] for item in data["items"]],
+                [
+                    "Job string not in the valid format",
+                    "Invalid Job Mode",
+                    "Batch entry malformed",
+                ]
+            )
+
     async def test_jobs_add_invalid_job_field(self):
         """
         Test a series of requests to /jobs/add/ with invalid job fields in
@@ -309,6 +440,315 @@ class RestRequestTestCase(AioHTTPTestCase):
                 self.assertEqual(data["mode"], mode.lower())
                 self.assertEqual(data["job"], "X(0), Y(0), X(0)")
 
+    async def test_jobs_optimize(self):
+        """
+        Test that /jobs/add/ stores the optimized job only when asked to
+        """
+        for optimize, status, optimized_job in [
+            (True, 201, "X(180), Z(90)"),
+            (False, 201, None),
+            ("yes", 400, None),
+        ]:
+            async with self.client.post(
+                "/jobs/add/",
+                headers=TEST_HEADERS,
+                json={
+                    "job": "X(90), X(90), Y(0), Z(450)",
+                    "mode": "echo",
+                    "optimize": optimize
+                }
+            ) as resp:
+                self.assertEqual(resp.status, status)
+                data = await resp.json()
+                if status != 201:
+                    self.assertEqual(data["error"], "Invalid optimize flag")
+                    continue
+                self.assertEqual(data["job"], "X(90), X(90), Y(0), Z(450)")
+                self.assertEqual(data["optimized_job"], optimized_job)
+
+            async with self.client.get(
+                f"/jobs/{data['id']}/",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual(
+                    (await resp.json())["optimized_job"],
+                    optimized_job
+                )
+
+    async def test_jobs_priority(self):
+        """
+        Test that /jobs/add/ stores the priority class and rejects unknown ones
+        """
+        for priority, status in [("high", 201), ("low", 201), ("urgent", 400)]:
+            async with self.client.post(
+                "/jobs/add/",
+                headers=TEST_HEADERS,
+                json={
+                    "job": "X(0)",
+                    "mode": "echo",
+                    "priority": priority
+                }
+            ) as resp:
+                self.assertEqual(resp.status, status)
+                data = await resp.json()
+                if status != 201:
+                    self.assertEqual(data["error"], "Invalid priority")
+                    continue
+                self.assertEqual(data["priority"], priority)
+
+            async with self.client.get(
+                f"/jobs/{data['id']}/",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual((await resp.json())["priority"], priority)
+
+    async def test_jobs_result_cache(self):
+        """
+        Test that with the result cache on, a repeated job is completed from
+        the cache without being dispatched
+        """
+        result_cache = Jobs.RESULT_CACHE
+        submit = Jobs.DISPATCHER.submit
+        Jobs.RESULT_CACHE = ResultCache(max_size=10)
+        try:
+            body = {"job": "Z(5), X(15)", "mode": "echo"}
+            async with self.client.post(
+                "/jobs/add/",
+                headers=TEST_HEADERS,
+                json=body
+            ) as resp:
+                first_id = (await resp.json())["id"]
+            async with self.client.get(
+                f"/jobs/{first_id}/?wait=30",
+                headers=TEST_HEADERS
+            ) as resp:
+                first = await resp.json()
+            self.assertIsNotNone(first["return_code"])
+
+            submitted = []
+            Jobs.DISPATCHER.submit = lambda *args: submitted.append(args)
+            async with self.client.post(
+                "/jobs/add/",
+                headers=TEST_HEADERS,
+                json=body
+            ) as resp:
+                self.assertEqual(resp.status, 201)
+                second_id = (await resp.json())["id"]
+            self.assertEqual(submitted, [])
+
+            async with self.client.get(
+                f"/jobs/{second_id}/",
+                headers=TEST_HEADERS
+            ) as resp:
+                second = await resp.json()
+            self.assertTrue(second["cached"])
+            self.assertFalse(first["cached"])
+            self.assertEqual(second["status"], first["status"])
+            self.assertEqual(second["return_code"], first["return_code"])
+
+        finally:
+            Jobs.RESULT_CACHE = result_cache
+            Jobs.DISPATCHER.submit = submit
+
+    async def test_jobs_simulation_times(self):
+        """
+        Test that a simulated job is stored with its start and end times
+        """
+        async with self.client.post(
+            "/jobs/add/",
+            headers=TEST_HEADERS,
+            json={"job": "X(31), Z(62)", "mode": "simulation"}
+        ) as resp:
+            job_id = (await resp.json())["id"]
+
+        async with self.client.get(
+            f"/jobs/{job_id}/?wait=30",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual((await resp.json())["status"], "Success")
+
+        STORAGE_INSTANCE.flush()
+        created_time, start_time, end_time = STORAGE_INSTANCE.get_reader().execute(
+            "SELECT created_time, start_time, end_time FROM jobs WHERE id = ?",
+            [job_id]
+        ).fetchone()
+        self.assertIsNotNone(start_time)
+        self.assertLessEqual(created_time, start_time)
+        self.assertLessEqual(start_time, end_time)
+
+    async def test_jobs_stream(self):
+        """
+        Test that /jobs/stream/ pushes the updates of the selected job as
+        server-sent events, and rejects invalid filters
+        """
+        async with self.client.get(
+            "/jobs/stream/?status=Done",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 400)
+            data = await resp.json()
+            self.assertEqual(data["error"], "Invalid stream filter")
+
+        async with self.client.post(
+            "/jobs/add/",
+            headers=TEST_HEADERS,
+            json={
+                "job": "Y(9), Z(13)",
+                "mode": "echo"
+            }
+        ) as resp:
+            job_id = (await resp.json())["id"]
+
+        async with self.client.get(
+            f"/jobs/stream/?id={job_id}&mode=echo&status=Success,Runtime Error",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.content_type, "text/event-stream")
+            self.assertEqual(await resp.content.readline(), b"event: update\n")
+            line = await asyncio.wait_for(resp.content.readline(), 20)
+            update = json.loads(line.decode("utf8")[len("data: "):])
+            self.assertEqual(update["id"], job_id)
+            self.assertEqual(update["mode"], "echo")
+            self.assertIn(update["status"], ("Success", "Runtime Error"))
+
+    async def test_jobs_stream_cached(self):
+        """
+        Test that /jobs/stream/ pushes the completion of a job that was served
+        from the result cache
+        """
+        result_cache = Jobs.RESULT_CACHE
+        Jobs.RESULT_CACHE = ResultCache(max_size=10)
+        try:
+            body = {"job": "Y(21), Z(34)", "mode": "echo"}
+            async with self.client.post(
+                "/jobs/add/",
+                headers=TEST_HEADERS,
+                json=body
+            ) as resp:
+                first_id = (await resp.json())["id"]
+            async with self.client.get(
+                f"/jobs/{first_id}/?wait=30",
+                headers=TEST_HEADERS
+            ) as resp:
+                first = await resp.json()
+
+            async with self.client.get(
+                "/jobs/stream/?mode=echo&status=Success,Runtime Error",
+                headers=TEST_HEADERS
+            ) as stream:
+                async with self.client.post(
+                    "/jobs/add/",
+                    headers=TEST_HEADERS,
+                    json=body
+                ) as resp:
+                    second_id = (await resp.json())["id"]
+
+                # other jobs may finish while this one is served
+                update = {}
+                while update.get("id") != second_id:
+                    line = await asyncio.wait_for(stream.content.readline(), 5)
+                    if line.startswith(b"data: "):
+                        update = json.loads(line.decode("utf8")[len("data: "):])
+
+            self.assertEqual(update["mode"], "echo")
+            self.assertEqual(update["status"], first["status"])
+            self.assertEqual(update["return_code"], first["return_code"])
+
+        finally:
+            Jobs.RESULT_CACHE = result_cache
+
+    async def test_jobs_wait(self):
+        """
+        Test that /jobs/{id}/?wait= returns once the job finished, and rejects
+        invalid waits
+        """
+        async with self.client.post(
+            "/jobs/add/",
+            headers=TEST_HEADERS,
+            json={
+                "job": "Y(7), Z(11)",
+                "mode": "echo"
+            }
+        ) as resp:
+            job_id = (await resp.json())["id"]
+
+        start = time.monotonic()
+        async with self.client.get(
+            f"/jobs/{job_id}/?wait=30",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 200)
+            data = await resp.json()
+            self.assertIn(data["status"], ("Success", "Runtime Error"))
+            self.assertIsNotNone(data["return_code"])
+        self.assertLess(time.monotonic() - start, 20)
+
+        for wait in ("-1", "abc", "nan", "1000"):
+            async with self.client.get(
+                f"/jobs/{job_id}/?wait={wait}",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual(resp.status, 400)
+                data = await resp.json()
+                self.assertEqual(data["error"], "Invalid wait parameter")
+
+    async def test_metrics(self):
+        """
+        Test that /metrics serves the Prometheus text format without an api
+        key and counts the requests per route
+        """
+        async with self.client.get("/jobs/list/", headers=TEST_HEADERS):
+            pass
+
+        async with self.client.get("/metrics") as resp:
+            self.assertEqual(resp.status, 200)
+            text = await resp.text()
+            self.assertIn("# TYPE job_queue_depth gauge", text)
+            self.assertIn('runtime_idle_seconds{runtime="1"}', text)
+            self.assertIn(
+                'http_request_duration_seconds_count{method="GET",route="/jobs/list"}',
+                text
+            )
+
+    async def test_server_timing(self):
+        """
+        Test that responses carry the time of each phase in the Server-Timing
+        header
+        """
+        async with self.client.get(
+            "/jobs/list/?limit=1",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 200)
+            phases = [
+                metric.split(";")[0]
+                for metric in resp.headers["Server-Timing"].split(", ")
+            ]
+            for phase in ("auth", "storage", "serialization", "total"):
+                self.assertIn(phase, phases)
+
+    async def test_admin_profile(self):
+        """
+        Test that /admin/profile/ returns a report of each profiler and
+        rejects invalid parameters
+        """
+        for profiler, expected in [("cprofile", "function calls"), ("sample", "samples")]:
+            async with self.client.get(
+                f"/admin/profile/?seconds=0.1&profiler={profiler}",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual(resp.status, 200)
+                self.assertIn(expected, await resp.text())
+
+        async with self.client.get(
+            "/admin/profile/?seconds=1000",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 400)
+            data = await resp.json()
+            self.assertEqual(data["error"], "Invalid profile parameters")
+
     async def test_jobs_list_post(self):
         """
         Test requests to /jobs/add/ that return runtime success
@@ -345,6 +785,59 @@ class RestRequestTestCase(AioHTTPTestCase):
             data = await resp.json()
             self.assertEqual(data["count"], 56)
             self.assertEqual(len(data["rows"]), 56)
+            self.assertIsNone(data["next"])
+            all_ids = [row["id"] for row in data["rows"]]
+
+        # walk the same rows page by page
+        paged_ids = []
+        after_id = 0
+        while after_id is not None:
+            async with self.client.get(
+                f"/jobs/list/?after_id={after_id}&limit=20",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual(resp.status, 200)
+                data = await resp.json()
+                self.assertLessEqual(data["count"], 20)
+                paged_ids.extend(row["id"] for row in data["rows"])
+                after_id = data["next"]
+
+        self.assertEqual(paged_ids, all_ids)
+
+    async def test_jobs_list_invalid_paging(self):
+        """
+        Test requests to /jobs/list/ with invalid pagination parameters
+        """
+        for query in ["limit=0", "limit=1001", "after_id=-1", "limit=ten"]:
+            async with self.client.get(
+                f"/jobs/list/?{query}",
+                headers=TEST_HEADERS
+            ) as resp:
+                self.assertEqual(resp.status, 400)
+                data = await resp.json()
+                self.assertEqual(data["error"], "Invalid pagination parameters")
+
+    async def test_jobs_export(self):
+        """
+        Test requests to /jobs/export/ that stream every job as NDJSON
+        """
+        async with self.client.post(
+            "/jobs/export/",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 400)
+
+        async with self.client.get(
+            "/jobs/export/",
+            headers=TEST_HEADERS
+        ) as resp:
+            self.assertEqual(resp.status, 200)
+            self.assertEqual(resp.content_type, "application/x-ndjson")
+            rows = [json.loads(line) async for line in resp.content]
+            self.assertEqual(
+                [row["id"] for row in rows],
+                list(range(1, 57))
+            )
 
     async def test_jobs_get_by_id(self):
         """
@@ -373,3 +866,1074 @@ class RestRequestTestCase(AioHTTPTestCase):
             self.assertIsNotNone(data["end_time"])
 
             #test_error_str = Runtime.decode_error(test[1])
+
+
+class DispatcherTestCase(unittest.TestCase):
+    """
+    This test case covers the job dispatcher and its worker coroutines
+    """
+
+    def test_fixed_worker_pool(self):
+        """
+        Test that a large backlog is handled without a thread per job
+        """
+        handled = []
+
+        async def handler(job_id):
+            await asyncio.sleep(0.01)
+            handled.append(job_id)
+
+        thread_count = threading.active_count()
+        dispatcher = Dispatcher(100, handler)
+        for job_id in range(1000):
+            dispatcher.submit(job_id)
+
+        self.assertEqual(threading.active_count(), thread_count + 1)
+
+        dispatcher.shutdown()
+        self.assertEqual(sorted(handled), list(range(1000)))
+        self.assertEqual(threading.active_count(), thread_count)
+
+
+class CoalesceTestCase(unittest.TestCase):
+    """
+    This test case covers sharing one run between identical jobs
+    """
+
+    def test_identical_jobs_share_a_run(self):
+        """
+        Test that identical jobs attach to the queued run and that other jobs
+        get a run of their own
+        """
+        (execution,) = Jobs.admit_job(1001, "X(7)", "echo")
+        try:
+            self.assertIsNone(Jobs.admit_job(1002, "X(7)", "echo"))
+            self.assertEqual(execution.job_ids, [1001, 1002])
+
+            (other,) = Jobs.admit_job(1003, "X(7)", "verbatim")
+            self.assertIsNot(other, execution)
+            self.assertEqual(other.job_ids, [1003])
+        finally:
+            Jobs.IN_FLIGHT.clear()
+
+    def test_failed_run_releases_runtime(self):
+        """
+        Test that a run whose runtime raises gives the runtime back to the pool
+        and ends every attached job with an error
+        """
+        class FailingRuntime:
+            """Runtime whose echo always raises"""
+            runtime_id = 1
+
+            def get_is_available(self):
+                """This fake runtime is always available"""
+                return True
+
+            async def echo_async(self, job):
+                """Fake echo that fails"""
+                raise RuntimeError(f"runtime failed on {job}")
+
+        updates = []
+
+        # pylint: disable=too-few-public-methods
+        class RecordingStorage:
+            """Records job updates instead of storing them"""
+
+            def update_job(self, db_id, status, *args, **_kwargs):
+                """Record the update"""
+                updates.append((db_id, status) + args)
+
+        async def run_test():
+            (execution,) = Jobs.admit_job(1101, parse_job("X(8)"), "echo")
+            self.assertIsNone(Jobs.admit_job(1102, parse_job("X(8)"), "echo"))
+            with self.assertRaises(RuntimeError):
+                await Jobs.job_handler(execution)
+
+        runtime_pool = Jobs.RUNTIME_POOL
+        storage = Jobs.STORAGE_INSTANCE
+        Jobs.RUNTIME_POOL = RuntimePool([FailingRuntime()])
+        Jobs.STORAGE_INSTANCE = RecordingStorage()
+        try:
+            asyncio.run(run_test())
+            self.assertEqual(len(Jobs.RUNTIME_POOL.free), 1)
+        finally:
+            Jobs.RUNTIME_POOL = runtime_pool
+            Jobs.STORAGE_INSTANCE = storage
+            Jobs.IN_FLIGHT.clear()
+
+        error = Runtime.decode_error(Jobs.RUN_ERROR)
+        self.assertEqual(updates[-2:], [
+            (1101, "Runtime Error", 1, Jobs.RUN_ERROR, error),
+            (1102, "Runtime Error", 1, Jobs.RUN_ERROR, error),
+        ])
+
+    def test_dispatcher_admit(self):
+        """
+        Test that jobs absorbed by the admit function are not queued
+        """
+        handled = []
+
+        async def handler(key):
+            handled.append(key)
+
+        def admit(key):
+            return None if key in handled_keys else (key,)
+
+        handled_keys = {"b"}
+        dispatcher = Dispatcher(1, handler, admit)
+        dispatcher.submit_many([("a",), ("b",), ("c",)])
+        dispatcher.shutdown()
+        self.assertEqual(handled, ["a", "c"])
+
+
+class RuntimePoolTestCase(unittest.TestCase):
+    """
+    This test case covers handing out runtimes from the runtime pool
+    """
+
+    def test_release_wakes_waiting_job(self):
+        """
+        Test that a job waiting for a runtime gets it as soon as it is released
+        """
+        async def run_test():
+            pool = RuntimePool([Runtime(1)])
+            runtime = await pool.acquire()
+            waiter = asyncio.ensure_future(pool.acquire())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+
+            pool.release(runtime)
+            self.assertIs(await asyncio.wait_for(waiter, 0.01), runtime)
+
+        asyncio.run(run_test())
+
+    def test_unavailable_runtime_is_deferred(self):
+        """
+        Test that a runtime released as unavailable is held back for the retry
+        delay
+        """
+        async def run_test():
+            pool = RuntimePool([Runtime(1)], retry_delay=0.1)
+            runtime = await pool.acquire()
+            pool.release(runtime, is_available=False)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(pool.acquire(), 0.01)
+            self.assertIs(await asyncio.wait_for(pool.acquire(), 1), runtime)
+
+        asyncio.run(run_test())
+
+
+class RuntimeAdapterTestCase(unittest.TestCase):
+    """
+    This test case covers the awaitable runtime interface
+    """
+
+    def test_blocking_runtime_is_adapted(self):
+        """
+        Test that a runtime with only the blocking interface can be awaited
+        """
+        class BlockingRuntime:
+            """Runtime that only implements the blocking interface"""
+            runtime_id = 1
+
+            def echo(self, job):
+                """Fake echo that returns the hard coded return code"""
+                return Runtime.echo_return_code(job)
+
+            def get_is_available(self):
+                """This fake runtime is always available"""
+                return True
+
+        native = Runtime(2)
+        self.assertIs(as_async_runtime(native), native)
+
+        adapted = as_async_runtime(BlockingRuntime())
+        self.assertIsInstance(adapted, BlockingRuntimeAdapter)
+        self.assertEqual(asyncio.run(adapted.echo_async("X(0), Y(0), X(0)")), 0)
+        self.assertEqual(asyncio.run(adapted.echo_async("X(90), Y(0), Z(90)")), 1)
+
+
+class LogWriterTestCase(unittest.TestCase):
+    """
+    This test case covers the background log writer
+    """
+
+    def test_records_flushed_on_shutdown(self):
+        """
+        Test that every queued record is written, in order, on shutdown
+        """
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_path = os.path.join(log_dir, "test.log")
+            writer = Logger.LogWriter(flush_interval=60)
+            for index in range(1000):
+                writer.write(f"record {index}\n", log_path)
+            writer.shutdown()
+
+            with open(log_path, encoding="utf8") as log:
+                lines = log.read().splitlines()
+            self.assertEqual(lines, [f"record {i}" for i in range(1000)])
+
+    def test_no_restart_after_shutdown(self):
+        """
+        Test that a write after shutdown does not start a new writer thread
+        and is still written
+        """
+        with tempfile.TemporaryDirectory() as log_dir:
+            log_path = os.path.join(log_dir, "test.log")
+            writer = Logger.LogWriter()
+            writer.shutdown()
+
+            self.assertFalse(writer.start())
+            writer.write("late\n", log_path)
+            self.assertIsNone(writer.thread)
+
+            with open(log_path, encoding="utf8") as log:
+                self.assertEqual(log.read(), "late\n")
+
+    def test_full_buffer_drops_records(self):
+        """
+        Test that records are dropped and counted when the buffer is full
+        """
+        writer = Logger.LogWriter(buffer_size=1)
+
+        # pretend the writer thread is running but stuck, so nothing drains
+        writer.thread = threading.current_thread()
+        writer.write("kept\n", "unused.log")
+        writer.write("dropped\n", "unused.log")
+        self.assertEqual(writer.dropped, 1)
+        self.assertEqual(writer.records.qsize(), 1)
+
+    def test_write_does_not_wait_for_batch(self):
+        """
+        Test that writing to a full buffer does not wait while the writer
+        thread holds its lock to write a batch
+        """
+        writer = Logger.LogWriter(buffer_size=1)
+        writer.thread = threading.current_thread()
+
+        # the writer thread holds the lock for the whole batch write
+        with writer.lock:
+            caller = threading.Thread(
+                target=lambda: [
+                    writer.write(f"record {index}\n", "unused.log")
+                    for index in range(3)
+                ]
+            )
+            caller.start()
+            caller.join(1)
+            self.assertFalse(caller.is_alive())
+
+        self.assertEqual(writer.take_dropped(), 2)
+        self.assertEqual(writer.dropped, 0)
+
+
+class ExportTestCase(unittest.TestCase):
+    """
+    This test case covers streaming the job table from /jobs/export/
+    """
+
+    def test_disconnect_during_fetch(self):
+        """
+        Test that a client disconnecting while a chunk is fetched cancels the
+        export and closes the generator once the fetch is done
+        """
+        fetching = threading.Event()
+        release = threading.Event()
+        closed = []
+
+        # pylint: disable=too-few-public-methods
+        class SlowStorage:
+            """Storage whose first chunk takes until release is set"""
+
+            def iter_jobs(self, _chunk_size):
+                """Yield one chunk once it is released"""
+                try:
+                    fetching.set()
+                    release.wait(5)
+                    yield [{"id": 1}]
+                finally:
+                    closed.append(True)
+
+        async def run_test():
+            export = asyncio.ensure_future(
+                Jobs.export_jobs(make_mocked_request("GET", "/jobs/export/"))
+            )
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                fetching.wait,
+                5
+            )
+            export.cancel()
+            await asyncio.sleep(0.05)
+            self.assertEqual(closed, [])
+
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await export
+
+        storage = Jobs.STORAGE_INSTANCE
+        Jobs.STORAGE_INSTANCE = SlowStorage()
+        try:
+            asyncio.run(run_test())
+        finally:
+            Jobs.STORAGE_INSTANCE = storage
+        self.assertEqual(closed, [True])
+
+
+class StorageTestCase(unittest.TestCase):
+    """
+    This test case covers the storage layer against a temporary database
+    """
+
+    def setUp(self):
+        """
+        Create a temporary directory for the test database
+        """
+        # cleaned up in tearDown
+        # pylint: disable=consider-using-with
+        self.db_dir = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.db_dir.name, "jobs.db")
+
+    def tearDown(self):
+        """
+        Remove the test database
+        """
+        self.db_dir.cleanup()
+
+    def test_group_commit(self):
+        """
+        Test that concurrent writes are committed together and that queued
+        updates are durable after a flush
+        """
+        storage = Storage(self.db_file, group_commit=True, commit_interval=0.01)
+        storage.migrate()
+        commit_count = []
+        commit_writes = storage.commit_writes
+        storage.commit_writes = lambda batch: (
+            commit_count.append(len(batch)), commit_writes(batch)
+        )
+
+        job_ids = []
+
+        def add_jobs():
+            for _ in range(25):
+                job_ids.append(storage.add_job("X(0)", "echo"))
+
+        # the writer waits for the write lock with its first batch until
+        # every thread has a write queued, so some batch holds several writes
+        with storage.write_lock:
+            threads = [threading.Thread(target=add_jobs) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            while not commit_count or (
+                commit_count[0] + storage.write_queue.qsize() < 20
+            ):
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(job_ids), list(range(1, 501)))
+        self.assertLess(len(commit_count), 500)
+
+        self.assertEqual(storage.update_job(1, "Success", 1, 0), 1)
+        storage.flush()
+        storage.close()
+
+        reader = sqlite3.connect(self.db_file)
+        self.assertEqual(
+            reader.execute("SELECT status FROM jobs WHERE id = 1").fetchone(),
+            ("Success",)
+        )
+        reader.close()
+
+    def test_group_commit_failures(self):
+        """
+        Test that a failing commit or callback fails its writes but leaves the
+        writer thread running
+        """
+        storage = Storage(self.db_file, group_commit=True)
+        storage.migrate()
+
+        def fail(_):
+            raise ValueError("callback failed")
+
+        self.assertEqual(storage.write(lambda cursor: 7, on_commit=fail), 7)
+
+        # a connection that can neither commit nor roll back
+        connection = storage.connection
+        storage.connection = object()
+        self.assertEqual(storage.write(lambda cursor: 7), 0)
+        storage.connection = connection
+
+        self.assertTrue(storage.writer.is_alive())
+        self.assertEqual(storage.add_job("X(0)", "echo"), 1)
+        storage.close()
+
+    def test_read_connections(self):
+        """
+        Test that each thread reads through its own read-only connection and
+        is not blocked by an open write transaction
+        """
+        # the update below bypasses storage, so it would miss the record cache
+        storage = Storage(
+            self.db_file,
+            pragmas={"synchronous": "OFF"},
+            record_cache_size=0
+        )
+        storage.migrate()
+        storage.add_job("X(0)", "echo")
+
+        reader = storage.get_reader()
+        self.assertIs(storage.get_reader(), reader)
+
+        check = storage.connect_reader()
+        self.assertEqual(
+            check.execute("PRAGMA journal_mode").fetchall(),
+            [("wal",)]
+        )
+        self.assertEqual(check.execute("PRAGMA synchronous").fetchall(), [(0,)])
+        with self.assertRaises(sqlite3.OperationalError):
+            check.execute("DELETE FROM jobs")
+        check.close()
+
+        other_readers = []
+        thread = threading.Thread(
+            target=lambda: other_readers.append(storage.get_reader())
+        )
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_readers[0], reader)
+
+        storage.connection.execute("BEGIN IMMEDIATE")
+        storage.connection.execute("UPDATE jobs SET status = 'Started'")
+        self.assertEqual(storage.get_job(1)["status"], "Scheduled")
+        storage.connection.commit()
+        self.assertEqual(storage.get_job(1)["status"], "Started")
+        storage.close()
+
+    def test_migrate(self):
+        """
+        Test that migrations are applied once and that a database created
+        before migrations existed is adopted
+        """
+        legacy = sqlite3.connect(self.db_file)
+        legacy.execute(migrations.MIGRATIONS[0][2][0])
+        legacy.execute("INSERT INTO jobs (job) VALUES ('X(0)')")
+        legacy.commit()
+        legacy.close()
+
+        storage = Storage(self.db_file)
+        latest = migrations.MIGRATIONS[-1][0]
+        self.assertEqual(storage.migrate(), latest)
+        self.assertEqual(storage.migrate(), latest)
+        self.assertEqual(
+            storage.connection.execute(
+                "SELECT version FROM schema_version"
+            ).fetchall(),
+            [(version,) for version, _, _ in migrations.MIGRATIONS]
+        )
+        self.assertEqual(storage.get_job(1)["job"], "X(0)")
+        self.assertEqual(storage.add_job("X(90)", "echo"), 2)
+        storage.close()
+
+    def test_add_jobs(self):
+        """
+        Test that a batch of jobs is stored in order, with the id of each row
+        """
+        storage = Storage(self.db_file, group_commit=True)
+        storage.migrate()
+        self.assertEqual(storage.add_job("X(0)", "echo"), 1)
+        self.assertEqual(
+            storage.add_jobs([("X(90)", "echo"), ("Y(90)", "simulation")]),
+            [2, 3]
+        )
+        self.assertEqual(storage.get_job(3)["job"], "Y(90)")
+        self.assertEqual(storage.get_job(3)["mode"], "simulation")
+        storage.close()
+
+    def test_add_jobs_with_cached_jobs(self):
+        """
+        Test that jobs served from the result cache are stored in the same
+        write as the rest of the batch, and announced as finished
+        """
+        storage = Storage(self.db_file)
+        storage.migrate()
+        updates = []
+        storage.add_update_listener(updates.append)
+        writes = []
+        write = storage.write
+
+        def count_write(function, *args, **kwargs):
+            writes.append(function)
+            return write(function, *args, **kwargs)
+
+        storage.write = count_write
+        self.assertEqual(
+            storage.add_jobs(
+                [("X(90)", "echo")],
+                [
+                    ("Y(90)", "echo", 2, "Error Code 2 TBD", None, "normal"),
+                    ("Z(90)", "echo", 0, None, None, "high"),
+                ]
+            ),
+            [1, 2, 3]
+        )
+        self.assertEqual(len(writes), 1)
+        self.assertFalse(storage.get_job(1)["cached"])
+        self.assertTrue(storage.get_job(2)["cached"])
+        self.assertEqual(storage.get_job(2)["status"], "Runtime Error")
+        self.assertEqual(storage.get_job(3)["status"], "Success")
+        self.assertEqual(
+            [(update["id"], update["return_code"]) for update in updates],
+            [(2, 2), (3, 0)]
+        )
+        storage.close()
+
+    def test_add_cached_job(self):
+        """
+        Test that a job served from the result cache is stored as completed
+        """
+        storage = Storage(self.db_file)
+        storage.migrate()
+        job_id = storage.add_cached_job("X(0)", "echo", 2, "Error Code 2 TBD")
+
+        job = storage.get_job(job_id)
+        self.assertTrue(job["cached"])
+        self.assertEqual(job["status"], "Runtime Error")
+        self.assertEqual(job["return_code"], 2)
+        self.assertIsNone(job["runtime"])
+        self.assertEqual(job["start_time"], job["end_time"])
+        self.assertFalse(storage.get_job(storage.add_job("X(0)", "echo"))["cached"])
+        storage.close()
+
+
+    def test_record_cache(self):
+        """
+        Test that added and updated jobs are served from the record cache and
+        match the database, and that evicted jobs are read from the database
+        """
+        storage = Storage(self.db_file, record_cache_size=2)
+        storage.migrate()
+        job_ids = [
+            storage.add_job("X(90)", "echo", priority="high", estimated_cost=2.0),
+            storage.add_cached_job("X(0)", "echo", 0),
+            *storage.add_jobs([("Y(90)", "verbatim")]),
+        ]
+        storage.update_job(job_ids[2], "Started", 1)
+        storage.update_job(job_ids[2], "Success", 1, 0)
+
+        self.assertEqual(list(storage.records.records), job_ids[1:])
+        reader = storage.get_reader()
+        for job_id in job_ids:
+            row = reader.execute("SELECT * FROM jobs WHERE id = ?", [job_id])
+            self.assertEqual(
+                storage.get_job(job_id),
+                storage.row_to_job(row.fetchone())
+            )
+        storage.close()
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """
+    This test case covers the job result cache
+    """
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used result is evicted when full
+        """
+        cache = ResultCache(max_size=2)
+        cache.put(("X(0)", "echo"), 0)
+        cache.put(("X(90)", "echo"), 4)
+        self.assertEqual(cache.get(("X(0)", "echo")), 0)
+
+        cache.put(("Y(90)", "echo"), 4)
+        self.assertIsNone(cache.get(("X(90)", "echo")))
+        self.assertEqual(cache.get(("X(0)", "echo")), 0)
+        self.assertEqual(cache.get(("Y(90)", "echo")), 4)
+
+    def test_ttl_and_disabled(self):
+        """
+        Test that results expire and that a zero size cache stores nothing
+        """
+        cache = ResultCache(max_size=2, ttl=0.01)
+        cache.put(("X(0)", "echo"), 0)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(("X(0)", "echo")))
+
+        cache = ResultCache()
+        self.assertFalse(cache.is_enabled)
+        cache.put(("X(0)", "echo"), 0)
+        self.assertIsNone(cache.get(("X(0)", "echo")))
+
+
+class JobParserTestCase(unittest.TestCase):
+    """
+    This test case covers the job string parser
+    """
+
+    def test_parse_valid(self):
+        """
+        Test that valid jobs are compiled to their canonical form
+        """
+        job = parse_job("x(090), Y(180), z(7)")
+        self.assertIsInstance(job, CompiledJob)
+        self.assertEqual(str(job), "X(90), Y(180), Z(7)")
+        self.assertEqual(list(job.axes), [0, 1, 2])
+        self.assertEqual(list(job.angles), [90, 180, 7])
+        self.assertEqual(list(job), [("X", 90), ("Y", 180), ("Z", 7)])
+        self.assertEqual(job, parse_job("X(90), Y(180), Z(7)"))
+        self.assertEqual(hash(job), hash(parse_job("X(90), Y(180), Z(7)")))
+
+    def test_parse_invalid(self):
+        """
+        Test that invalid jobs are rejected
+        """
+        for text in [
+            "", "X", "X(", "X()", "X(1234)", "X(9O)", "W(90)", "X(90),Y(90)",
+            "X(90), ", "X(90) ", " X(90)", "X(90), Y(90", "X(\u0669)", None, 90,
+            ["X(90)"],
+        ]:
+            with self.subTest(text=text):
+                self.assertIsNone(parse_job(text))
+
+    def test_parse_memo(self):
+        """
+        Test that repeated job strings are served from the memo
+        """
+        self.assertIs(parse_job("X(1), Y(2)"), parse_job("X(1), Y(2)"))
+
+    def test_parse_memo_keeps_valid_jobs_only(self):
+        """
+        Test that invalid and overlong job strings are not memoised
+        """
+        long_job = ", ".join(["X(90)"] * 300)
+        size = parse_job_memo.cache_info().currsize
+        self.assertIsNone(parse_job("X(1), Y(2"))
+        self.assertIsNone(parse_job("W" * 100000))
+        self.assertEqual(len(parse_job(long_job)), 300)
+        self.assertEqual(parse_job_memo.cache_info().currsize, size)
+
+
+class JobOptimizerTestCase(unittest.TestCase):
+    """
+    This test case covers the rotation optimizer
+    """
+
+    def test_optimize(self):
+        """
+        Test that redundant rotations are merged, normalised and dropped
+        """
+        for text, expected in [
+            ("X(90), X(90)", "X(180)"),
+            ("Y(0), X(90)", "X(90)"),
+            ("Z(720), Y(370)", "Y(10)"),
+            ("X(90), Y(180), Y(180), X(90)", "X(180)"),
+            ("X(90), Y(90), X(90)", "X(90), Y(90), X(90)"),
+            ("X(180), X(180), Y(0)", "X(0)"),
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(str(optimize_job(parse_job(text))), expected)
+
+    def test_optimal_job_is_kept(self):
+        """
+        Test that a job with nothing to optimize is returned unchanged
+        """
+        job = parse_job("X(90), Y(90)")
+        self.assertIs(optimize_job(job), job)
+
+
+class SimulatorTestCase(unittest.TestCase):
+    """
+    This test case covers the NumPy simulator
+    """
+
+    def test_simulate_batch(self):
+        """
+        Test that rotations are composed in order and that a batch gives the
+        same result as simulating every job on its own
+        """
+        jobs = [
+            parse_job("X(90)"),
+            parse_job("Z(90), X(90)"),
+            parse_job("Y(45), Y(45), Y(270)"),
+        ]
+        rotations = simulate_batch(jobs)
+
+        # a quarter turn about X takes the Y axis to the Z axis
+        self.assertTrue(numpy.allclose(rotations[0] @ [0, 1, 0], [0, 0, 1]))
+        # Z(90) takes X to Y, then X(90) takes Y to Z
+        self.assertTrue(numpy.allclose(rotations[1] @ [1, 0, 0], [0, 0, 1]))
+        self.assertTrue(numpy.allclose(rotations[2], numpy.eye(3)))
+
+        for job, rotation in zip(jobs, rotations):
+            self.assertTrue(numpy.allclose(simulate_batch([job])[0], rotation))
+        self.assertEqual(run_simulation(jobs), [0, 0, 0])
+
+    def test_failed_batch(self):
+        """
+        Test that every job of a batch that could not be simulated gets
+        SIMULATION_ERROR, and that other batches still succeed
+        """
+        results = []
+        batcher = SimulationBatcher(
+            lambda item, code: results.append((item, code)),
+            batch_size=2
+        )
+
+        async def add_jobs():
+            batcher.add(0, parse_job("X(90), Y(0), Z(90)"))
+            batcher.add(1, parse_job("X(1)"))
+            # not a compiled job, so the batch can not be packed
+            batcher.add(2, "X(90)")
+            batcher.add(3, parse_job(", ".join(["X(90)", "Y(90)"] * 7500)))
+            await asyncio.sleep(0)
+
+        asyncio.run(add_jobs())
+        self.assertEqual(
+            results,
+            [(0, 0), (1, 0), (2, SIMULATION_ERROR), (3, SIMULATION_ERROR)]
+        )
+
+    def test_batcher(self):
+        """
+        Test that jobs added in one loop iteration are simulated in one pass
+        """
+        results = []
+        started = []
+        batcher = SimulationBatcher(
+            lambda item, code: results.append((item, code)),
+            on_start=started.append
+        )
+
+        async def add_jobs():
+            for item in range(10):
+                batcher.add(item, parse_job("X(90), Y(90)"))
+            self.assertEqual(results, [])
+            await asyncio.sleep(0)
+
+        asyncio.run(add_jobs())
+        self.assertEqual(started, list(range(10)))
+        self.assertEqual(results, [(item, 0) for item in range(10)])
+
+    def test_batcher_process_pool(self):
+        """
+        Test that chunks are simulated on worker processes and that drain
+        waits for every result
+        """
+        results = []
+        executor = ProcessPoolExecutor(
+            max_workers=2,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        batcher = SimulationBatcher(
+            lambda item, code: results.append((item, code)),
+            executor,
+            worker_count=2
+        )
+
+        async def add_jobs():
+            for item in range(200):
+                batcher.add(item, parse_job(f"X({item}), Z(90), Y({item})"))
+            await batcher.drain()
+
+        try:
+            asyncio.run(add_jobs())
+        finally:
+            batcher.shutdown()
+        self.assertEqual(sorted(results), [(item, 0) for item in range(200)])
+
+
+    def test_batcher_broken_pool(self):
+        """
+        Test that the jobs of a broken pool are still simulated, that the pool
+        is replaced and that jobs added after shutdown are simulated too
+        """
+        results = []
+
+        # stands in for a pool whose worker process was killed
+        # pylint: disable=abstract-method
+        class BrokenPool(Executor):
+            """
+            An executor that fails every chunk it is given
+            """
+
+            def submit(self, fn, /, *args, **kwargs):
+                future = Future()
+                future.set_exception(BrokenProcessPool("worker killed"))
+                return future
+
+        replacements = []
+
+        def create_pool():
+            replacements.append(ThreadPoolExecutor(max_workers=1))
+            return replacements[-1]
+
+        batcher = SimulationBatcher(
+            lambda item, code: results.append((item, code)),
+            BrokenPool(),
+            executor_factory=create_pool
+        )
+
+        async def add_jobs(items):
+            for item in items:
+                batcher.add(item, parse_job("X(90), Y(90)"))
+            await batcher.drain()
+
+        try:
+            asyncio.run(add_jobs(range(100)))
+            self.assertEqual(len(replacements), 1)
+            self.assertIs(batcher.executor, replacements[0])
+            asyncio.run(add_jobs(range(100, 200)))
+        finally:
+            batcher.shutdown()
+        self.assertIsNone(batcher.executor)
+
+        asyncio.run(add_jobs(range(200, 300)))
+        self.assertEqual(sorted(results), [(item, 0) for item in range(300)])
+        self.assertEqual(len(replacements), 1)
+
+
+class FairQueueTestCase(unittest.TestCase):
+    """
+    This test case covers weighted fair queueing across priority classes
+    """
+
+    @staticmethod
+    def drain(queue: FairQueue) -> list:
+        """
+        Return every item of a queue in the order it is served
+        """
+        items = []
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        return items
+
+    def test_weighted_share(self):
+        """
+        Test that a backlog of low priority items does not hold up high
+        priority items queued after it, and that stop markers come last
+        """
+        async def fill():
+            queue = FairQueue({"high": 8, "low": 1}, lambda item: item[0])
+            for index in range(40):
+                queue.put_nowait(("low", index))
+            queue.put_nowait(None)
+            for index in range(40):
+                queue.put_nowait(("high", index))
+            return self.drain(queue)
+
+        items = asyncio.run(fill())
+        first = [name for name, _ in items[:18]]
+        self.assertEqual(first.count("high"), 16)
+        self.assertEqual(items[-1], None)
+        self.assertEqual(
+            [index for name, index in items[:-1] if name == "low"],
+            list(range(40))
+        )
+
+    def test_shortest_first_with_aging(self):
+        """
+        Test that cheaper items are served first unless a more expensive item
+        has waited long enough to make up the difference
+        """
+        async def fill(aging):
+            queue = FairQueue(
+                {"normal": 1},
+                lambda item: "normal",
+                cost=lambda item: item[1],
+                aging=aging
+            )
+            queue.put_nowait(("long", 5.0))
+            time.sleep(0.05)
+            queue.put_nowait(("short", 1.0))
+            queue.put_nowait(("medium", 3.0))
+            return [name for name, _ in self.drain(queue)]
+
+        self.assertEqual(asyncio.run(fill(0.0)), ["short", "medium", "long"])
+        # 0.05 seconds of waiting is worth more than 4 cost units
+        self.assertEqual(asyncio.run(fill(100.0)), ["long", "short", "medium"])
+
+    def test_starvation_protection(self):
+        """
+        Test that items that waited past max_wait are served oldest first
+        """
+        async def fill():
+            queue = FairQueue(
+                {"high": 100, "low": 1},
+                lambda item: item[0],
+                max_wait=0,
+                aged_interval=1
+            )
+            for index in range(5):
+                queue.put_nowait(("low", index))
+                queue.put_nowait(("high", index))
+            self.assertEqual(queue.qsize(), 10)
+            return self.drain(queue)
+
+        self.assertEqual(
+            [name for name, _ in asyncio.run(fill())],
+            ["low", "high"] * 5
+        )
+
+
+    def test_aged_backlog_keeps_weights(self):
+        """
+        Test that high priority items queued after a low priority backlog
+        that has aged past max_wait are not served behind the whole backlog
+        """
+        async def fill():
+            queue = FairQueue(
+                {"high": 8, "low": 1},
+                lambda item: item[0],
+                max_wait=0.05
+            )
+            for index in range(100):
+                queue.put_nowait(("low", index))
+            time.sleep(0.06)
+            for index in range(10):
+                queue.put_nowait(("high", index))
+            return self.drain(queue)
+
+        items = asyncio.run(fill())
+        first = [name for name, _ in items[:16]]
+        # every high item is served early, and the aged backlog still gets
+        # one in every four serves
+        self.assertEqual(first.count("high"), 10)
+        self.assertGreaterEqual(first[:8].count("low"), 2)
+        self.assertEqual(
+            [index for name, index in items if name == "low"],
+            list(range(100))
+        )
+
+
+class CostModelTestCase(unittest.TestCase):
+    """
+    This test case covers the job runtime estimates
+    """
+
+    def test_estimate_follows_measurements(self):
+        """
+        Test that estimates scale with the rotation count and move towards the
+        measured time per rotation
+        """
+        model = CostModel(initial_rate=1.0, smoothing=0.5)
+        self.assertEqual(model.estimate(parse_job("X(1), Y(2)"), "echo"), 2.0)
+
+        model.observe(parse_job("X(1), Y(2)"), "echo", 0.4)
+        self.assertAlmostEqual(model.estimate(parse_job("X(1)"), "echo"), 0.2)
+
+        model.observe(parse_job("X(1)"), "echo", 0.6)
+        self.assertAlmostEqual(model.estimate(parse_job("X(1)"), "echo"), 0.4)
+        self.assertEqual(model.estimate(parse_job("X(1)"), "verbatim"), 1.0)
+
+
+class JobEventsTestCase(unittest.TestCase):
+    """
+    This test case covers waiting for jobs to finish
+    """
+
+    def test_final_update_wakes_waiter(self):
+        """
+        Test that a final update from another thread completes the waiter and
+        that other updates do not
+        """
+        events = JobEvents()
+
+        async def wait():
+            future = events.add_waiter(1)
+            other = events.add_waiter(2)
+            threading.Thread(
+                target=events.job_updated,
+                args=({"id": 1, "status": "Running"},)
+            ).start()
+            threading.Thread(
+                target=events.job_updated,
+                args=({"id": 1, "status": "Success"},)
+            ).start()
+            await asyncio.wait_for(future, 5)
+
+            # a waiter that times out is removed
+            await asyncio.wait([other], timeout=0.01)
+            events.remove_waiter(2, other)
+            return future.result(), other.done()
+
+        update, other_done = asyncio.run(wait())
+        self.assertEqual(update["status"], "Success")
+        self.assertFalse(other_done)
+        self.assertEqual(events.waiters, {})
+
+    def test_stream_filters_and_drops(self):
+        """
+        Test that stream subscribers only get matching updates and drop the
+        ones that do not fit in their queue
+        """
+        stream = JobStream()
+
+        async def subscribe():
+            subscriber = Subscriber(modes={"echo"}, max_size=2)
+            stream.subscribe(subscriber)
+            for job_id in range(4):
+                stream.job_updated(
+                    {"id": job_id, "mode": "echo", "status": "Started"}
+                )
+            stream.job_updated({"id": 9, "mode": "verbatim", "status": "Started"})
+            # let the loop run the queued puts
+            await asyncio.sleep(0)
+            stream.unsubscribe(subscriber)
+
+            updates = []
+            while not subscriber.queue.empty():
+                updates.append(subscriber.queue.get_nowait()["id"])
+            return updates, subscriber.take_dropped()
+
+        self.assertEqual(asyncio.run(subscribe()), ([0, 1], 2))
+        self.assertEqual(stream.subscribers, set())
+
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    This test case covers the metric types
+    """
+
+    def test_counter_shards(self):
+        """
+        Test that counter updates from several threads are summed
+        """
+        counter = Counter("test_total", "Test counter", ("mode",))
+        threads = [
+            threading.Thread(
+                target=lambda: [counter.inc("echo") for _ in range(1000)]
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc("verbatim", amount=2.5)
+
+        self.assertEqual(
+            counter.values(),
+            {("echo",): 4000.0, ("verbatim",): 2.5}
+        )
+        self.assertIn('test_total{mode="echo"} 4000.0', list(counter.render()))
+
+    def test_histogram(self):
+        """
+        Test that histogram buckets are cumulative and end with +Inf
+        """
+        histogram = Histogram("test_seconds", "Test", ("mode",), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, "echo")
+
+        self.assertEqual(
+            list(histogram.samples()),
+            [
+                'test_seconds_bucket{mode="echo",le="0.1"} 1',
+                'test_seconds_bucket{mode="echo",le="1.0"} 3',
+                'test_seconds_bucket{mode="echo",le="+Inf"} 4',
+                'test_seconds_sum{mode="echo"} 6.05',
+                'test_seconds_count{mode="echo"} 4',
+            ]
+        )